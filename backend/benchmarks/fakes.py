@@ -0,0 +1,429 @@
+"""Local stand-ins of Google Calendar/Tasks, the web pages and the chat model.
+
+Every request sleeps for a configurable latency and is counted as a round trip,
+so the pipeline can be measured without network access or credentials.
+"""
+
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+import threading
+import time
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from src.prompts import REVIEWER_SYSTEM
+
+
+@dataclass
+class FakeConfig:
+    """Size of the fake data and latency of the fake backends."""
+
+    calendars: int = 4
+    events_per_calendar: int = 12
+    task_lists: int = 3
+    tasks_per_list: int = 20
+    # Tasks of each list that are "Leer <url>" and need a page download
+    reading_tasks_per_list: int = 3
+    # Items per page of the list requests
+    page_size: int = 25
+    # Words of each fake web page
+    page_words: int = 3000
+    google_latency: float = 0.03  # Seconds per Google API request
+    web_latency: float = 0.05  # Seconds per web page download
+    llm_latency: float = 0.2  # Seconds per model invocation
+
+
+class RoundTrips:
+    """Thread-safe counter of the requests made to each backend."""
+
+    def __init__(self) -> None:
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts.clear()
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(sorted(self._counts.items()))
+
+
+class FakeRequest:
+    """Request of the Google API client, only sent on execute()."""
+
+    def __init__(
+        self, backend: "FakeGoogleServices", name: str, result: Callable[[], Any]
+    ) -> None:
+        self.backend = backend
+        self.name = name
+        self.result = result
+
+    def execute(self) -> Any:
+        self.backend.round_trip(self.name)
+        return self.result()
+
+
+class FakeBatch:
+    """Batch HTTP request, all the requests added are sent in one round trip."""
+
+    def __init__(self, backend: "FakeGoogleServices", callback: Callable) -> None:
+        self.backend = backend
+        self.callback = callback
+        self._requests = []
+
+    def add(self, request: FakeRequest, request_id: str) -> None:
+        self._requests.append((request_id, request))
+
+    def execute(self) -> None:
+        if not self._requests:
+            return
+        self.backend.round_trip("batch")
+        for request_id, request in self._requests:
+            self.callback(request_id, request.result(), None)
+
+
+class _Resource:
+    """Resource of a fake service client, e.g. service.events()."""
+
+    def __init__(self, backend: "FakeGoogleServices", name: str, **methods) -> None:
+        self.backend = backend
+        self.name = name
+        self.methods = methods
+
+    def __getattr__(self, method: str):
+        if method not in self.methods:
+            raise AttributeError(method)
+
+        def request(**kwargs) -> FakeRequest:
+            return FakeRequest(
+                self.backend,
+                f"{self.name}.{method}",
+                lambda: self.methods[method](**kwargs),
+            )
+
+        return request
+
+
+def _page(items: List[Dict[str, Any]], page_size: int, **kwargs) -> Dict[str, Any]:
+    """Get the page of the items selected by pageToken/maxResults."""
+    start = int(kwargs.get("pageToken") or 0)
+    size = kwargs.get("maxResults") or page_size
+    page = {"items": items[start : start + size]}
+    if start + size < len(items):
+        page["nextPageToken"] = str(start + size)
+    return page
+
+
+def _time(value: Dict[str, str] | str) -> datetime:
+    """Get the datetime of an ISO string or of the start or end of an event."""
+    if isinstance(value, dict):
+        value = value["dateTime"]
+    return datetime.fromisoformat(value)
+
+
+class FakeGoogleServices:
+    """Drop-in replacement of GoogleServices backed by generated data.
+
+    Events are generated for the current day in the given timezone. Requests
+    with a syncToken or updatedMin return no changes, like a calendar that was
+    not modified since the previous run. The events created are kept apart and
+    only listed when filtering by a private extended property.
+    """
+
+    def __init__(
+        self, config: FakeConfig, round_trips: RoundTrips, timezone, calendar_id="bench"
+    ) -> None:
+        self.config = config
+        self.round_trips = round_trips
+        self.calendar_id = calendar_id
+        self.timezone = timezone
+        self.created_events = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        today = datetime.now(timezone).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        self.calendar_list = [
+            {"id": f"calendar-{c}", "summary": f"Calendar {c}"}
+            for c in range(config.calendars)
+        ]
+        self.events = {}
+        for c, calendar in enumerate(self.calendar_list):
+            events = []
+            for i in range(config.events_per_calendar):
+                # Spread the events between 8:00 and 22:00
+                minutes = (c * 25 + i * 70) % (14 * 60)
+                start = today + timedelta(hours=8, minutes=minutes)
+                end = start + timedelta(minutes=30 + 15 * (i % 3))
+                events.append(
+                    {
+                        "id": f"event-{c}-{i}",
+                        "summary": f"Event {c}-{i}",
+                        "start": {"dateTime": start.isoformat()},
+                        "end": {"dateTime": end.isoformat()},
+                    }
+                )
+            events.sort(key=lambda event: event["start"]["dateTime"])
+            self.events[calendar["id"]] = events
+
+        self.task_list_items = [
+            {"id": f"tasklist-{t}", "title": f"Task list {t}"}
+            for t in range(config.task_lists)
+        ]
+        self.task_items = {}
+        for t, task_list in enumerate(self.task_list_items):
+            tasks = []
+            for i in range(config.tasks_per_list):
+                if i < config.reading_tasks_per_list:
+                    title = f"Leer https://bench.local/{t}/{i}"
+                else:
+                    title = f"Task {t}-{i}"
+                task = {"id": f"task-{t}-{i}", "title": title, "position": f"{i:020d}"}
+                if i % 2 == 0:
+                    task["due"] = (today + timedelta(days=i % 5)).isoformat()
+                tasks.append(task)
+            self.task_items[task_list["id"]] = tasks
+
+        self.calendar = _FakeCalendarService(self)
+        self.tasks = _FakeTasksService(self)
+
+    def round_trip(self, name: str) -> None:
+        time.sleep(self.config.google_latency)
+        self.round_trips.add(f"google.{name}")
+
+    def list_events(self, calendarId: str, **kwargs) -> Dict[str, Any]:
+        if kwargs.get("syncToken"):
+            return {"items": [], "nextSyncToken": "sync"}
+        if kwargs.get("privateExtendedProperty"):
+            return _page(
+                self._planned_events(calendarId, **kwargs),
+                self.config.page_size,
+                **kwargs,
+            )
+        page = _page(self.events.get(calendarId, []), self.config.page_size, **kwargs)
+        if "nextPageToken" not in page:
+            page["nextSyncToken"] = "sync"
+        return page
+
+    def _planned_events(
+        self, calendarId: str, privateExtendedProperty: str, **kwargs
+    ) -> List[Dict[str, Any]]:
+        """Created events with the given private property in the time window."""
+        key, value = privateExtendedProperty.split("=", 1)
+        time_min = kwargs.get("timeMin")
+        time_max = kwargs.get("timeMax")
+        with self._lock:
+            events = list(self.created_events)
+        return [
+            event
+            for event in events
+            if calendarId == self.calendar_id
+            and event.get("extendedProperties", {}).get("private", {}).get(key)
+            == value
+            and (time_min is None or _time(event["end"]) > _time(time_min))
+            and (time_max is None or _time(event["start"]) < _time(time_max))
+        ]
+
+    def insert_event(self, calendarId: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self._next_id += 1
+            event = {
+                **self._with_offsets(body),
+                "id": f"created-{self._next_id}",
+                "htmlLink": f"https://calendar.local/{self._next_id}",
+            }
+            self.created_events.append(event)
+        return event
+
+    def patch_event(
+        self, calendarId: str, eventId: str, body: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        with self._lock:
+            event = next(e for e in self.created_events if e["id"] == eventId)
+            event.update(self._with_offsets(body))
+        return event
+
+    def _with_offsets(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Add the UTC offset to local times, Google returns all times with it."""
+        body = dict(body)
+        for key in ("start", "end"):
+            if key in body and "dateTime" in body[key]:
+                value = datetime.fromisoformat(body[key]["dateTime"])
+                if value.tzinfo is None:
+                    value = self.timezone.localize(value)
+                body[key] = {**body[key], "dateTime": value.isoformat()}
+        return body
+
+    def delete_event(self, calendarId: str, eventId: str) -> str:
+        with self._lock:
+            self.created_events = [
+                e for e in self.created_events if e["id"] != eventId
+            ]
+        return ""
+
+    def list_tasks(self, tasklist: str, **kwargs) -> Dict[str, Any]:
+        if kwargs.get("updatedMin"):
+            return {"items": []}
+        return _page(self.task_items.get(tasklist, []), self.config.page_size, **kwargs)
+
+
+class _FakeCalendarService:
+    def __init__(self, backend: FakeGoogleServices) -> None:
+        self.backend = backend
+
+    def calendarList(self) -> _Resource:
+        return _Resource(
+            self.backend,
+            "calendarList",
+            list=lambda **kwargs: _page(
+                self.backend.calendar_list, self.backend.config.page_size, **kwargs
+            ),
+        )
+
+    def events(self) -> _Resource:
+        return _Resource(
+            self.backend,
+            "events",
+            list=self.backend.list_events,
+            insert=self.backend.insert_event,
+            patch=self.backend.patch_event,
+            delete=self.backend.delete_event,
+        )
+
+    def new_batch_http_request(self, callback: Callable) -> FakeBatch:
+        return FakeBatch(self.backend, callback)
+
+
+class _FakeTasksService:
+    def __init__(self, backend: FakeGoogleServices) -> None:
+        self.backend = backend
+
+    def tasklists(self) -> _Resource:
+        return _Resource(
+            self.backend,
+            "tasklists",
+            list=lambda **kwargs: _page(
+                self.backend.task_list_items, self.backend.config.page_size, **kwargs
+            ),
+        )
+
+    def tasks(self) -> _Resource:
+        return _Resource(self.backend, "tasks", list=self.backend.list_tasks)
+
+
+class FakeResponse:
+    """Streamed response of requests.get."""
+
+    def __init__(self, status_code: int, body: bytes, headers: Dict[str, str]) -> None:
+        self.status_code = status_code
+        self.headers = headers
+        self.encoding = "utf-8"
+        self._body = body
+
+    def __enter__(self) -> "FakeResponse":
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def iter_content(self, chunk_size: int = 1):
+        for start in range(0, len(self._body), chunk_size):
+            yield self._body[start : start + chunk_size]
+
+
+class FakeWeb:
+    """Replacement of requests.get serving generated HTML pages."""
+
+    def __init__(self, config: FakeConfig, round_trips: RoundTrips) -> None:
+        self.config = config
+        self.round_trips = round_trips
+        paragraph = " ".join(f"word{i}" for i in range(100))
+        paragraphs = "".join(
+            f"<p>{paragraph}</p>\n" for _ in range(max(config.page_words // 100, 1))
+        )
+        self.page = (
+            "<html><head><script>var ignored = 1;</script></head>"
+            f"<body>{paragraphs}</body></html>"
+        ).encode()
+
+    def get(self, url: str, headers: Dict[str, str] = None, **kwargs) -> FakeResponse:
+        time.sleep(self.config.web_latency)
+        self.round_trips.add("web.get")
+        etag = f'"{len(self.page)}"'
+        if headers and headers.get("If-None-Match") == etag:
+            return FakeResponse(304, b"", {"ETag": etag})
+        return FakeResponse(
+            200,
+            self.page,
+            {
+                "Content-Type": "text/html; charset=utf-8",
+                "Content-Length": str(len(self.page)),
+                "ETag": etag,
+            },
+        )
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model with scripted answers for each step of the agent.
+
+    The planner answers the given schedule and the reviewer approves it. With
+    tools bound, the model asks once to create the given events and then stops.
+    """
+
+    schedule: str = ""
+    events_to_create: List[Dict[str, str]] = []
+    latency: float = 0.2
+    round_trips: Any = None
+    tool_mode: bool = False
+    max_tokens: int = 4000
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def bind_tools(self, tools, **kwargs) -> "FakeChatModel":
+        return self.model_copy(update={"tool_mode": True})
+
+    def _generate(
+        self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs
+    ) -> ChatResult:
+        time.sleep(self.latency)
+        if self.round_trips is not None:
+            self.round_trips.add("llm.invoke")
+
+        if self.tool_mode:
+            if any(isinstance(message, ToolMessage) for message in messages):
+                message = AIMessage(content="The events were created.")
+            else:
+                message = AIMessage(
+                    content="",
+                    tool_calls=[
+                        {
+                            "name": "create_calendar_events",
+                            "args": {"calendar_events": self.events_to_create},
+                            "id": "call_0",
+                        }
+                    ],
+                )
+        elif (
+            isinstance(messages[0], SystemMessage)
+            and messages[0].content == REVIEWER_SYSTEM
+        ):
+            message = AIMessage(content="OK")
+        else:
+            message = AIMessage(content=self.schedule)
+
+        return ChatResult(generations=[ChatGeneration(message=message)])
@@ -0,0 +1,368 @@
+"""Offline benchmark of the scheduling pipeline.
+
+Runs the agent against the fake Google, web and LLM backends of
+benchmarks.fakes and reports the wall time of every graph node, the peak
+memory and the round trips to each backend. The first run (cold) starts with
+empty caches, the second one (warm) reuses the caches of the first.
+
+Usage, from the backend directory:
+    python -m benchmarks.run                    # Print the report
+    python -m benchmarks.run --check            # Compare with the baseline and
+                                                # check the parallel tool calls
+    python -m benchmarks.run --update-baseline  # Save the report as baseline
+"""
+
+from contextlib import redirect_stdout
+from dataclasses import asdict, fields
+from datetime import datetime, timedelta
+from typing import Any, Dict
+from unittest import mock
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import json
+import time
+import io
+import os
+import sys
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from src.agent import create_agent, PLANNING_MODES
+from src.cache import SyncCache, ReadingTimeCache
+from src.llm import RateLimiter
+from src.models import Schedule, ScheduleEntry
+from src.tools import use_services, create_calendar_event, upsert_planned_events
+from src.tools import search_tools
+from src.utils import run_concurrently
+from src.tools.calendar_tools import timezone
+from benchmarks.fakes import (
+    FakeConfig,
+    FakeChatModel,
+    FakeGoogleServices,
+    FakeWeb,
+    RoundTrips,
+)
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+# Relative increase of a time or memory measure reported as a regression
+TOLERANCE = 0.5
+# Seconds of noise ignored when comparing times
+TIME_SLACK = 0.05
+SCENARIOS = ("cold", "warm")
+# Duration of the events created for the tasks
+TASK_SLOT = timedelta(minutes=15)
+
+
+class NodeTimer(BaseCallbackHandler):
+    """Callback handler that measures the wall time of every graph node."""
+
+    def __init__(self) -> None:
+        self.nodes: Dict[str, Dict[str, float]] = {}
+        self._starts = {}
+        self._lock = threading.Lock()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        # The run of a node has the name of the node, its inner runs do not
+        name = kwargs.get("name")
+        if metadata and name == metadata.get("langgraph_node"):
+            with self._lock:
+                self._starts[run_id] = (name, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._stop(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._stop(run_id)
+
+    def _stop(self, run_id) -> None:
+        with self._lock:
+            if run_id not in self._starts:
+                return
+            name, start = self._starts.pop(run_id)
+            node = self.nodes.setdefault(name, {"calls": 0, "seconds": 0.0})
+            node["calls"] += 1
+            node["seconds"] += time.perf_counter() - start
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {"calls": node["calls"], "seconds": round(node["seconds"], 3)}
+            for name, node in sorted(self.nodes.items())
+        }
+
+
+def create_benchmark_agent(
+    config: FakeConfig, planning_mode: str, cache_dir: str, round_trips: RoundTrips
+):
+    """Create the agent and the fake backends it runs against."""
+    services = FakeGoogleServices(config, round_trips, timezone)
+    web = FakeWeb(config, round_trips)
+
+    # The fake planner answers with the events of the day, which passes the
+    # review, and the tasks are created in consecutive slots. Neither depends
+    # on the time the benchmark runs, so the round trips are always the same.
+    schedule = Schedule(
+        entries=sorted(
+            (
+                ScheduleEntry(
+                    summary=event["summary"],
+                    start=event["start"]["dateTime"],
+                    end=event["end"]["dateTime"],
+                    fixed=True,
+                )
+                for calendar_events in services.events.values()
+                for event in calendar_events
+            ),
+            key=lambda entry: entry.start,
+        )
+    )
+    day_start = datetime.now(timezone).replace(
+        hour=8, minute=0, second=0, microsecond=0
+    )
+    tasks = [task for items in services.task_items.values() for task in items]
+    events_to_create = [
+        {
+            "summary": task["title"],
+            "start_time": (day_start + i * TASK_SLOT).isoformat(),
+            "end_time": (day_start + (i + 1) * TASK_SLOT).isoformat(),
+        }
+        for i, task in enumerate(tasks)
+    ]
+    model = FakeChatModel(
+        schedule=str(schedule),
+        events_to_create=events_to_create,
+        latency=config.llm_latency,
+        round_trips=round_trips,
+    )
+
+    agent = create_agent(
+        model=model,
+        planning_mode=planning_mode,
+        sync_cache=SyncCache(os.path.join(cache_dir, "sync_cache.sqlite3")),
+        reading_time_cache=ReadingTimeCache(
+            os.path.join(cache_dir, "reading_time_cache.sqlite3")
+        ),
+        # The benchmark measures the pipeline, not the provider limits
+        rate_limiter=RateLimiter(requests_per_minute=60_000, burst=1_000),
+    )
+    return agent, services, web
+
+
+def run_scenario(agent, services, web, round_trips: RoundTrips, verbose=False):
+    """Run the agent once and measure it."""
+    round_trips.reset()
+    timer = NodeTimer()
+    output = sys.stdout if verbose else io.StringIO()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with (
+        use_services(services),
+        mock.patch.object(search_tools.requests, "get", web.get),
+        redirect_stdout(output),
+    ):
+        for _ in agent.stream(config={"callbacks": [timer]}):
+            pass
+    wall_time = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    trips = round_trips.as_dict()
+    return {
+        "wall_time": round(wall_time, 3),
+        "peak_memory_kb": round(peak / 1024),
+        "total_round_trips": sum(trips.values()),
+        "round_trips": trips,
+        "nodes": timer.summary(),
+    }
+
+
+def run_benchmark(
+    config: FakeConfig, planning_mode: str = "llm", verbose: bool = False
+) -> Dict[str, Any]:
+    """Run the cold and warm scenarios.
+
+    Returns:
+        dict: The configuration and the measures of each scenario.
+    """
+    round_trips = RoundTrips()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        agent, services, web = create_benchmark_agent(
+            config, planning_mode, cache_dir, round_trips
+        )
+        scenarios = {
+            scenario: run_scenario(agent, services, web, round_trips, verbose)
+            for scenario in SCENARIOS
+        }
+    return {
+        "planning_mode": planning_mode,
+        "config": asdict(config),
+        "scenarios": scenarios,
+    }
+
+
+def check_parallel_planning(config: FakeConfig) -> list[str]:
+    """Check that the create calls of the same turn do not move the same event.
+
+    A planned event is split in two by two calls that run at the same time,
+    like the parallel tool calls of a turn. Both halves must be in the calendar.
+
+    Returns:
+        list[str]: The problems found, empty when the events are right.
+    """
+    services = FakeGoogleServices(config, RoundTrips(), timezone)
+    start = datetime.now(timezone).replace(hour=10, minute=0, second=0, microsecond=0)
+    halves = [
+        (start + i * timedelta(hours=1), start + (i + 1) * timedelta(hours=1))
+        for i in range(2)
+    ]
+    with use_services(services), redirect_stdout(io.StringIO()):
+        upsert_planned_events(
+            [
+                {
+                    "summary": "Study",
+                    "start_time": start.isoformat(),
+                    "end_time": halves[-1][1].isoformat(),
+                }
+            ]
+        )
+        results = run_concurrently(
+            lambda half: create_calendar_event.invoke(
+                {
+                    "summary": "Study",
+                    "start_time": half[0].isoformat(),
+                    "end_time": half[1].isoformat(),
+                }
+            ),
+            halves,
+            max_workers=len(halves),
+        )
+
+    problems = [f"Parallel create call failed: {error}" for _, error in results if error]
+    planned = sorted(
+        (
+            datetime.fromisoformat(event["start"]["dateTime"]),
+            datetime.fromisoformat(event["end"]["dateTime"]),
+        )
+        for event in services.created_events
+    )
+    if planned != halves:
+        problems.append(
+            "Parallel create calls planned "
+            + ", ".join(f"{s:%H:%M}-{e:%H:%M}" for s, e in planned)
+            + " instead of 10:00-11:00, 11:00-12:00"
+        )
+    return problems
+
+
+def compare(
+    report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = TOLERANCE
+) -> list[str]:
+    """Get the regressions of a report with respect to the baseline.
+
+    Round trips must not increase. Times and memory may increase up to the
+    tolerance, times also by TIME_SLACK seconds.
+    """
+    if (report["planning_mode"], report["config"]) != (
+        baseline["planning_mode"],
+        baseline["config"],
+    ):
+        return ["The configuration is not the one of the baseline"]
+
+    def slower(value: float, base: float) -> bool:
+        return value > base * (1 + tolerance) + TIME_SLACK
+
+    regressions = []
+    for scenario, base in baseline["scenarios"].items():
+        measures = report["scenarios"][scenario]
+        for name, count in measures["round_trips"].items():
+            if count > base["round_trips"].get(name, 0):
+                regressions.append(
+                    f"{scenario}: {count} {name} round trips "
+                    f"(baseline {base['round_trips'].get(name, 0)})"
+                )
+        for name, node in measures["nodes"].items():
+            base_node = base["nodes"].get(name, {"calls": 0, "seconds": 0.0})
+            if slower(node["seconds"], base_node["seconds"]):
+                regressions.append(
+                    f"{scenario}: node {name} took {node['seconds']}s "
+                    f"(baseline {base_node['seconds']}s)"
+                )
+        if slower(measures["wall_time"], base["wall_time"]):
+            regressions.append(
+                f"{scenario}: run took {measures['wall_time']}s "
+                f"(baseline {base['wall_time']}s)"
+            )
+        if measures["peak_memory_kb"] > base["peak_memory_kb"] * (1 + tolerance):
+            regressions.append(
+                f"{scenario}: peak memory {measures['peak_memory_kb']} KiB "
+                f"(baseline {base['peak_memory_kb']} KiB)"
+            )
+    return regressions
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"Planning mode: {report['planning_mode']}")
+    for scenario, measures in report["scenarios"].items():
+        print(
+            f"\n[{scenario}] {measures['wall_time']}s, "
+            f"peak memory {measures['peak_memory_kb']} KiB, "
+            f"{measures['total_round_trips']} round trips"
+        )
+        for name, node in measures["nodes"].items():
+            print(f"  {name:<32} {node['calls']:>3}x {node['seconds']:>8.3f}s")
+        for name, count in measures["round_trips"].items():
+            print(f"  {name:<32} {count:>4} round trips")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--planning-mode", choices=PLANNING_MODES, default="llm")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument(
+        "--check", action="store_true", help="Fail on regressions of the baseline"
+    )
+    parser.add_argument(
+        "--update-baseline", action="store_true", help="Save the report as baseline"
+    )
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument(
+        "--verbose", action="store_true", help="Show the output of the agent"
+    )
+    # Sizes and latencies of the fake backends
+    for field in fields(FakeConfig):
+        parser.add_argument(
+            f"--{field.name.replace('_', '-')}",
+            type=type(field.default),
+            default=field.default,
+        )
+    args = parser.parse_args()
+
+    config = FakeConfig(
+        **{field.name: getattr(args, field.name) for field in fields(FakeConfig)}
+    )
+    report = run_benchmark(config, args.planning_mode, args.verbose)
+    print_report(report)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(report, file, indent=2)
+            file.write("\n")
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if args.check:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(report, baseline, args.tolerance)
+        regressions += check_parallel_planning(config)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
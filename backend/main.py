@@ -1,12 +1,16 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from functools import lru_cache
+from typing import Optional
 import uvicorn
 import sys
 import os
 
 # Add your src folder to Python path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+sys.path.append(os.path.dirname(__file__))
 
 # Import your existing modules
 # from your_module1 import your_function
@@ -42,6 +46,97 @@ def process_data(data: dict):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@lru_cache(maxsize=None)
+def get_agent_pool():
+    # Imported on first use so the server starts without loading the agent
+    from src.agent_pool import AgentPool
+
+    return AgentPool()
+
+
+async def stream_user_schedule(
+    agent, user_id: Optional[str], calendar_id: Optional[str]
+):
+    from src.streaming import stream_schedule as stream_graph
+
+    stream = stream_graph(
+        agent.graph, {"messages": []}, config={"recursion_limit": 100}
+    )
+    if user_id is None:
+        # Single user setup, token.json and CALENDAR_ID
+        with get_agent_pool().default_user():
+            async for event in stream:
+                yield event
+        return
+
+    with get_agent_pool().user(user_id, calendar_id):
+        async for event in stream:
+            yield event
+
+
+def session_user(authorization: Optional[str]) -> Optional[str]:
+    """Get the user of the session token in the Authorization header, if any."""
+    from src.sessions import read_session_token
+
+    if authorization is None:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Expected a Bearer session token")
+    try:
+        return read_session_token(token.strip())
+    except (ValueError, RuntimeError) as e:
+        raise HTTPException(status_code=401, detail=str(e))
+
+
+@app.get("/api/schedule/stream")
+async def stream_schedule(
+    planning_mode: str = "llm",
+    calendar_id: Optional[str] = None,
+    days: int = 1,
+    structured: bool = False,
+    authorization: Optional[str] = Header(None),
+):
+    """Plan the day, streaming the progress of the agent as server-sent events.
+
+    With a session token (Authorization: Bearer <token>), the day of its user
+    is planned with the Google token in tokens/<user_id>.json, in the primary
+    calendar of the user unless calendar_id is given. With days, the next days
+    are planned in the same run. With structured, the events of the schedule
+    are created without the event creator LLM.
+    """
+    from src.agent import PLANNING_MODES, MAX_PLANNING_DAYS
+
+    user_id = session_user(authorization)
+    if planning_mode not in PLANNING_MODES:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown planning mode '{planning_mode}'"
+        )
+    if not 1 <= days <= MAX_PLANNING_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"The number of days must be between 1 and {MAX_PLANNING_DAYS}",
+        )
+    agent = get_agent_pool().get_agent(
+        planning_mode=planning_mode, planning_days=days, structured=structured
+    )
+    return StreamingResponse(
+        stream_user_schedule(agent, user_id, calendar_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/metrics")
+def get_metrics():
+    """Metrics of the runs since the server started, in the Prometheus text format."""
+    from src.metrics import registry
+
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 if __name__ == "__main__":
     uvicorn.run(
         app, 
@@ -1,15 +1,22 @@
 import os
+import uuid
+import argparse
 from dotenv import load_dotenv
-from typing import Any, TypedDict, Annotated, Dict
+from typing import Any, TypedDict, Annotated, Dict, Iterator
 import operator
-import time
-import json
+from datetime import datetime, timedelta
 import re
 
 # Agent imports
 from langchain_ollama import ChatOllama
 from langchain_together import ChatTogether
-from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage, ToolMessage
+from langchain_core.messages import (
+    AnyMessage,
+    SystemMessage,
+    HumanMessage,
+    ToolMessage,
+    AIMessage,
+)
 
 # from langgraph.prebuilt import create_react_agent
 from langchain_core.messages import HumanMessage
@@ -17,6 +24,8 @@ from langgraph.graph import StateGraph, END
 from langfuse import Langfuse
 from langfuse.callback import CallbackHandler
 from langgraph.graph.state import CompiledStateGraph
+from langchain_core.runnables import RunnableConfig
+from pydantic import ValidationError
 import openai
 
 # Prompts
@@ -28,6 +37,12 @@ from src.prompts import (
     REVIEW_PROMT,
     REVIEWER_PROMPT,
     REVIEWER_SYSTEM,
+    DRAFT_PROMPT,
+    PRE_REVIEW_FEEDBACK,
+    PLANNING_WINDOW_PROMPT,
+    PLANNING_WINDOW_REVIEW,
+    CANDIDATE_PROMPTS,
+    STRUCTURED_PLAN_PROMPT,
 )
 
 try:
@@ -41,12 +56,20 @@ from src.models import (
     TaskListModel,
     CalendarEventList,
     TasksList,
+    Schedule,
+    RenderOptions,
+    render_current_time,
+    render_events,
+    render_tasks,
 )
 
 # Tools imports
 from src.tools import (
     create_calendar_event,
     create_calendar_events,
+    upsert_planned_events,
+    list_planned_events,
+    use_plan_run,
     list_calendars,
     get_calendar_events,
     list_tasks,
@@ -54,11 +77,54 @@ from src.tools import (
     get_current_time,
     get_date_in_iso_format,
     sum_to_date,
-    get_time_read,
+    estimate_reading_time,
+    is_parallel_safe,
+)
+
+# Utils imports
+from src.utils import (
+    run_concurrently,
+    getDateTimeFromISO8601String,
+    local_datetime,
+)
+from src.cache import (
+    SyncCache,
+    ReadingTimeCache,
+    ResponseCache,
+    response_cache_key,
+    get_sync_cache,
 )
+from src.scheduling import (
+    build_draft_schedule,
+    validate_schedule,
+    planning_dates,
+    split_events_by_day,
+    score_schedule,
+)
+from src.llm import (
+    fit_messages,
+    model_context_window,
+    RateLimiter,
+    default_rate_limiter,
+)
+from src.checkpoint import create_checkpointer, CreatedEventsLedger
+from src import metrics
 
 load_dotenv()
 
+# How the schedule is created:
+#   "llm": the planner LLM places the tasks.
+#   "draft": the scheduling engine places the tasks and the planner LLM refines them.
+#   "fast": the draft of the scheduling engine is the schedule, without planner
+#       or reviewer LLM calls.
+PLANNING_MODES = ("llm", "draft", "fast")
+# Maximum number of days planned in a single run
+MAX_PLANNING_DAYS = 14
+# Sampling temperature of the candidate schedules other than the first one
+CANDIDATE_TEMPERATURE = 0.7
+# Tools that create calendar events, recorded in the ledger of the agent
+EVENT_TOOLS = ("create_calendar_event", "create_calendar_events")
+
 
 # GRAPH
 class ScheduleState(TypedDict):
@@ -74,62 +140,183 @@ class ScheduleState(TypedDict):
     calendars: CalendarEventList  # List of calendars
     events: list[CalendarEvent]  # List of calendar events
     tasks: list[TaskListModel]  # List of tasks
+    draft: Schedule  # Tasks placed around the events by the scheduling engine
     schedule: str  # Generated schedule
+    structured_schedule: Schedule  # Generated schedule, when it is structured
     feedback: str  # Feedback of the schedule
 
     rewrites: int  # Number of rewrites done
+    errors: Annotated[list[str], operator.add]  # Sources that could not be fetched
 
 
 class Agent:
     def __init__(
-        self, model, tools, checkpointer=None, system: str = "", max_rewrites: int = 3
+        self,
+        model,
+        tools,
+        checkpointer=None,
+        system: str = "",
+        max_rewrites: int = 3,
+        max_workers: int = 8,
+        sync_cache: SyncCache | None = None,
+        reading_time_cache: ReadingTimeCache | None = None,
+        planning_mode: str = "llm",
+        render_options: RenderOptions = RenderOptions(),
+        context_window: int | None = None,
+        rate_limiter: RateLimiter = default_rate_limiter,
+        response_cache: ResponseCache | None = None,
+        pre_review: bool = True,
+        tool_timeout: float = 60,
+        ledger: CreatedEventsLedger | None = None,
+        planning_days: int = 1,
+        candidates: int = 1,
+        structured: bool = False,
     ) -> None:
+        if planning_mode not in PLANNING_MODES:
+            raise ValueError(f"Unknown planning mode '{planning_mode}'")
+        if candidates < 1:
+            raise ValueError("At least one candidate schedule is needed")
+        if not 1 <= planning_days <= MAX_PLANNING_DAYS:
+            raise ValueError(
+                f"The planning window must have 1 to {MAX_PLANNING_DAYS} days"
+            )
+
         self.checkpointer = checkpointer
         self.system = system
         self.max_rewrites = max_rewrites
+        self.max_workers = max_workers  # Concurrent fetches, 1 fetches sequentially
+        self.sync_cache = sync_cache  # Only fetch changes since the last run
+        self.reading_time_cache = reading_time_cache
+        self.planning_mode = planning_mode  # One of PLANNING_MODES
+        self.render_options = render_options  # How events and tasks appear in prompts
+        # Tokens of the model context left for the input after the generated ones,
+        # the context of the model is the one of its name when not given
+        context_window = context_window or model_context_window(model)
+        self.max_input_tokens = context_window - (getattr(model, "max_tokens", 0) or 0)
+        self.rate_limiter = rate_limiter  # Shared by every model invocation
+        # Opt-in cache of the plan and review responses
+        self.response_cache = response_cache
+        # Check the schedule with rules before asking the reviewer LLM
+        self.pre_review = pre_review
+        self.tool_timeout = tool_timeout  # Seconds each tool call may take
+        # Events created by each thread, so resumed runs do not create them again
+        self.ledger = ledger
+        # Days planned in a run, starting today. Their events are fetched at once
+        self.planning_days = planning_days
+        # Schedules generated concurrently by the planner, the best scored one is kept
+        self.candidates = candidates
+        # The planner returns a Schedule and its events are created without the
+        # event creator LLM
+        self.structured = structured
 
         self.graph = self.build_graph()
 
         self.tools = {t.name: t for t in tools}
         self.model = model.bind_tools(tools)
         self.planner = model
+        # Model that writes the schedule, the reviewer uses the planner
+        self.schedule_writer = model
+        if structured:
+            self.schedule_writer = model.bind_tools(
+                [Schedule], tool_choice=Schedule.__name__
+            )
         self.time_estimator = model.bind(max_tokens=100)
 
     def build_graph(self) -> CompiledStateGraph:
         graph = StateGraph(ScheduleState)
-        graph.add_node("get_current_time", self.get_current_time)
-        graph.add_node("get_calendars", self.get_calendars)
-        graph.add_node("get_calendar_events", self.get_calendar_events)
-        graph.add_node("get_tasks", self.get_tasks)
-        graph.add_node(
-            "get_time_duration_leer_tasks", self.get_time_duration_leer_tasks
-        )
-        graph.add_node("plan", self.plan)
-        graph.add_node("review", self.review)
-        graph.add_node("prompt_event_creation", self.prompt_event_creation)
-        graph.add_node("llm", self.call_llm)
-        graph.add_node("action", self.take_action)
 
+        def add_node(name: str, node) -> None:
+            # Every node records its duration in the metrics
+            graph.add_node(name, metrics.timed_node(name, node))
+
+        add_node("get_current_time", self.get_current_time)
+        add_node("get_calendars", self.get_calendars)
+        add_node("get_calendar_events", self.get_calendar_events)
+        add_node("get_tasks", self.get_tasks)
+        add_node("get_time_duration_leer_tasks", self.get_time_duration_leer_tasks)
+        add_node("draft_schedule", self.draft_schedule)
+        add_node("plan", self.plan)
+        add_node("review", self.review)
+        if self.structured:
+            add_node("create_events", self.create_events)
+        else:
+            add_node("prompt_event_creation", self.prompt_event_creation)
+            add_node("llm", self.call_llm)
+            add_node("action", self.take_action)
+        # Node that creates the events of the approved schedule
+        creation = "create_events" if self.structured else "prompt_event_creation"
+
+        # Calendars and tasks are fetched in two parallel branches
         graph.add_edge("get_current_time", "get_calendars")
         graph.add_edge("get_calendars", "get_calendar_events")
-        graph.add_edge("get_calendar_events", "get_tasks")
-        graph.add_edge("get_tasks", "get_time_duration_leer_tasks")
-        graph.add_edge("get_time_duration_leer_tasks", "plan")
-        graph.add_edge("plan", "review")
-        graph.add_conditional_edges(
-            "review",
-            self.confirm_schedule,
-            {True: "prompt_event_creation", False: "plan"},
+        graph.add_edge("get_current_time", "get_tasks")
+        graph.add_edge(
+            ["get_calendar_events", "get_tasks"], "get_time_duration_leer_tasks"
         )
-        graph.add_edge("prompt_event_creation", "llm")
-        graph.add_conditional_edges(
-            "llm", self.exists_action, {True: "action", False: END}
-        )
-        graph.add_edge("action", "llm")
+        if self.planning_mode == "llm":
+            graph.add_edge("get_time_duration_leer_tasks", "plan")
+        else:
+            graph.add_edge("get_time_duration_leer_tasks", "draft_schedule")
+            graph.add_edge("draft_schedule", "plan")
+
+        if self.planning_mode == "fast":
+            # The draft has no conflicts, there is nothing to review
+            graph.add_edge("plan", creation)
+        else:
+            graph.add_edge("plan", "review")
+            graph.add_conditional_edges(
+                "review",
+                self.confirm_schedule,
+                {True: creation, False: "plan"},
+            )
+        if self.structured:
+            graph.add_edge("create_events", END)
+        else:
+            graph.add_edge("prompt_event_creation", "llm")
+            graph.add_conditional_edges(
+                "llm", self.exists_action, {True: "action", False: END}
+            )
+            graph.add_edge("action", "llm")
 
         graph.set_entry_point("get_current_time")
         return graph.compile(checkpointer=self.checkpointer)
 
+    def invoke_model(
+        self, model, messages: list[AnyMessage], cache: bool = False
+    ) -> AIMessage:
+        """Invoke one of the models of the agent within the rate limit
+
+        Args:
+            cache (bool): Whether the response can be taken from and saved to the
+                response cache of the agent, if it has one.
+        """
+        if not cache or self.response_cache is None:
+            return self._invoke_model(model, messages)
+
+        key = response_cache_key(model, messages)
+        message = self.response_cache.get(key)
+        metrics.inc(
+            "scheduler_cache_requests_total",
+            cache="response",
+            result="miss" if message is None else "hit",
+        )
+        if message is None:
+            message = self._invoke_model(model, messages)
+            self.response_cache.put(key, message)
+        return message
+
+    def _invoke_model(self, model, messages: list[AnyMessage]) -> AIMessage:
+        with metrics.timer("scheduler_llm_request_duration_seconds"):
+            message = self.rate_limiter.invoke(model, messages)
+
+        usage = getattr(message, "usage_metadata", None) or {}
+        for kind in ("input", "output"):
+            if usage.get(f"{kind}_tokens"):
+                metrics.inc(
+                    "scheduler_llm_tokens_total", usage[f"{kind}_tokens"], type=kind
+                )
+        return message
+
     def get_current_time(self, state: ScheduleState) -> Dict[str, Any]:
         current_time = get_current_time.invoke("")
         return {"current_time": current_time}
@@ -139,25 +326,52 @@ class Agent:
         return {"calendars": calendars}
 
     def get_calendar_events(self, state: ScheduleState) -> Dict[str, Any]:
-        events = [
-            {calendar.summary: get_calendar_events(calendar.id)}
-            for calendar in state["calendars"]
-        ]
+        calendars = state["calendars"]
+        sync_cache = get_sync_cache(self.sync_cache)
+        results = run_concurrently(
+            lambda calendar: get_calendar_events(
+                calendar.id, cache=sync_cache, days=self.planning_days
+            ),
+            calendars,
+            max_workers=self.max_workers,
+        )
+
+        events, errors = [], []
+        for calendar, (calendar_events, error) in zip(calendars, results):
+            if error is not None:
+                print(f"Could not fetch the events of '{calendar.summary}': {error}")
+                errors.append(f"Calendar {calendar.summary}: {error}")
+                continue
+            events.append({calendar.summary: calendar_events})
+
         events = CalendarEventList(events=events)
-        return {"events": events}
+        return {"events": events, "errors": errors}
 
     def get_tasks(self, state: ScheduleState) -> Dict[str, Any]:
         tasks_lists = list_tasks()
-        tasks = [
-            {task_list.title: get_tasks(task_list.id)} for task_list in tasks_lists
-        ]
+        sync_cache = get_sync_cache(self.sync_cache)
+        results = run_concurrently(
+            lambda task_list: get_tasks(task_list.id, cache=sync_cache),
+            tasks_lists,
+            max_workers=self.max_workers,
+        )
+
+        tasks, errors = [], []
+        for task_list, (task_list_tasks, error) in zip(tasks_lists, results):
+            if error is not None:
+                print(f"Could not fetch the tasks of '{task_list.title}': {error}")
+                errors.append(f"Task list {task_list.title}: {error}")
+                continue
+            tasks.append({task_list.title: task_list_tasks})
+
         tasks = TasksList(tasks=tasks)
-        return {"tasks": tasks}
+        return {"tasks": tasks, "errors": errors}
 
     def get_time_duration_leer_tasks(self, state: ScheduleState) -> Dict[str, Any]:
         regex = re.compile(
             r"https?:\/\/(www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?&//=]*)"
         )
+        tasks_by_url = {}
         for task_list in state["tasks"].tasks:
             for task in list(task_list.values())[0]:
                 title_match = "leer" in task.title.lower() and re.search(
@@ -174,25 +388,75 @@ class Agent:
                     url = notes_match.group(0)
 
                 if url:
-                    task.duration = json.loads(get_time_read.invoke({"url": url}))[
-                        "time"
-                    ]
+                    tasks_by_url.setdefault(url, []).append(task)
 
-        return {"tasks": state["tasks"]}
+        urls = list(tasks_by_url)
+        results = run_concurrently(
+            lambda url: estimate_reading_time(url, cache=self.reading_time_cache),
+            urls,
+            max_workers=self.max_workers,
+        )
+
+        errors = []
+        for url, (reading_time, error) in zip(urls, results):
+            if error is not None:
+                print(f"Could not estimate the reading time of '{url}': {error}")
+                errors.append(f"Reading time {url}: {error}")
+                continue
+            for task in tasks_by_url[url]:
+                task.duration = reading_time
+
+        return {"tasks": state["tasks"], "errors": errors}
+
+    def draft_schedule(self, state: ScheduleState) -> Dict[str, Any]:
+        draft = build_draft_schedule(
+            state["events"],
+            state["tasks"],
+            state["current_time"],
+            days=self.planning_days,
+        )
+        return {"draft": draft}
 
     def plan(self, state: ScheduleState) -> Dict[str, Any]:
+        if self.planning_mode == "fast":
+            message = AIMessage(content=str(state["draft"]))
+            return {
+                "planning_messages": [message],
+                "schedule": message.content,
+                "structured_schedule": state["draft"],
+            }
+
         prompts = [
             SystemMessage(PLANNER_SYSTEM),
             HumanMessage(
                 content=PLANNER_PROMPT.format(
-                    current_time=state["current_time"],
-                    events=state["events"],
-                    tasks=state["tasks"],
+                    current_time=render_current_time(
+                        state["current_time"], self.render_options
+                    ),
+                    events=self.render_window_events(state),
+                    tasks=render_tasks(state["tasks"], self.render_options),
                 )
+                + self.render_window_prompt(state, PLANNING_WINDOW_PROMPT)
                 + PERSONAL_PROMPT,
             ),
         ]
 
+        if self.structured:
+            prompts.append(
+                HumanMessage(
+                    content=STRUCTURED_PLAN_PROMPT.format(
+                        current_time=render_current_time(
+                            state["current_time"], self.render_options
+                        )
+                    )
+                )
+            )
+
+        if state.get("draft", None) is not None:
+            prompts.append(
+                HumanMessage(content=DRAFT_PROMPT.format(draft=state["draft"]))
+            )
+
         if state.get("feedback", None) is not None:
             prompts.append(
                 HumanMessage(
@@ -202,24 +466,131 @@ class Agent:
                 )
             )
 
-        message = self.planner.invoke(prompts)
+        if self.candidates == 1:
+            message = self.invoke_model(self.schedule_writer, prompts, cache=True)
+        else:
+            message = self.plan_candidates(state, prompts)
+        schedule, structured_schedule = self.read_schedule(message)
         return {
             "planning_messages": [message],
-            "schedule": message.content,
+            "schedule": schedule,
+            "structured_schedule": structured_schedule,
             "feedback": None,
         }
 
+    def read_schedule(self, message: AIMessage) -> tuple[str, Schedule | None]:
+        """Get the schedule written by the planner.
+
+        Returns:
+            tuple: The schedule as text and, when the planner is structured, as a
+                Schedule. The Schedule is None if the planner did not give a valid one.
+        """
+        if not self.structured:
+            return message.content, None
+
+        for tool_call in message.tool_calls:
+            if tool_call["name"] != Schedule.__name__:
+                continue
+            try:
+                schedule = Schedule.model_validate(tool_call["args"])
+            except ValidationError as e:
+                print(f"The planner gave an invalid schedule: {e}")
+                continue
+            return str(schedule), schedule
+        return message.content, None
+
+    def plan_candidates(
+        self, state: ScheduleState, prompts: list[AnyMessage]
+    ) -> AIMessage:
+        """Generate the candidate schedules concurrently and keep the best scored one.
+
+        The first candidate uses the planner as is, the others sample with a
+        higher temperature and an extra instruction each.
+        """
+        variants = [(self.schedule_writer, prompts)]
+        for i in range(1, self.candidates):
+            hint = CANDIDATE_PROMPTS[(i - 1) % len(CANDIDATE_PROMPTS)]
+            variants.append(
+                (
+                    self.schedule_writer.bind(temperature=CANDIDATE_TEMPERATURE),
+                    prompts + [HumanMessage(content=hint)],
+                )
+            )
+
+        results = run_concurrently(
+            lambda variant: self.invoke_model(*variant, cache=True),
+            variants,
+            max_workers=self.candidates,
+        )
+
+        best, best_score = None, None
+        for i, (message, error) in enumerate(results):
+            if error is not None:
+                print(f"Candidate schedule {i} failed: {error}")
+                continue
+            schedule, structured_schedule = self.read_schedule(message)
+            score = score_schedule(
+                schedule if structured_schedule is None else structured_schedule,
+                state["events"],
+                state["tasks"],
+                state["current_time"],
+                days=self.planning_days,
+            )
+            print(f"Candidate schedule {i}: {score}")
+            if best_score is None or score.total > best_score.total:
+                best, best_score = message, score
+
+        if best is None:
+            # Every candidate failed, raise the error of the first one
+            raise results[0][1]
+        return best
+
     def review(self, state: ScheduleState) -> Dict[str, Any]:
-        message = self.planner.invoke(
+        violations = None
+        if self.structured and state.get("structured_schedule") is None:
+            # The events of the schedule could not be created
+            violations = [
+                "The schedule is not a valid list of entries with a summary and "
+                "a start and end in ISO 8601 format."
+            ]
+        elif self.pre_review:
+            # Structured schedules are checked as they are, not their text
+            schedule = state.get("structured_schedule")
+            violations = validate_schedule(
+                state["schedule"] if schedule is None else schedule,
+                state["events"],
+                state["current_time"],
+                days=self.planning_days,
+            )
+
+        # Clear results do not need the reviewer LLM
+        if violations is not None:
+            if violations:
+                feedback = PRE_REVIEW_FEEDBACK.format(
+                    violations="\n".join(f"- {violation}" for violation in violations)
+                )
+            else:
+                feedback = "The schedule passed the automatic review. OK"
+            return {
+                "planning_messages": [AIMessage(content=feedback)],
+                "feedback": feedback,
+                "rewrites": state.get("rewrites", 0) + 1,
+            }
+
+        message = self.invoke_model(
+            self.planner,
             [
                 SystemMessage(REVIEWER_SYSTEM),
                 HumanMessage(
                     content=REVIEWER_PROMPT.format(
-                        schedule=state["schedule"], events=state["events"]
+                        schedule=state["schedule"],
+                        events=self.render_window_events(state),
                     )
+                    + self.render_window_prompt(state, PLANNING_WINDOW_REVIEW)
                     + PERSONAL_PROMPT,
                 ),
-            ]
+            ],
+            cache=True,
         )
 
         return {
@@ -228,6 +599,106 @@ class Agent:
             "rewrites": state.get("rewrites", 0) + 1,
         }
 
+    def render_window_events(self, state: ScheduleState) -> str:
+        """Render the events for a prompt, under their date when planning several days."""
+        if self.planning_days == 1:
+            return render_events(state["events"], self.render_options)
+
+        dates = planning_dates(state["current_time"], self.planning_days)
+        events_by_day = split_events_by_day(state["events"], dates)
+        return "\n\n".join(
+            f"{day:%A %Y-%m-%d}:\n{render_events(events, self.render_options)}"
+            for day, events in events_by_day.items()
+        )
+
+    def render_window_prompt(self, state: ScheduleState, prompt: str) -> str:
+        """Format a prompt about the planning window, empty when planning only today."""
+        if self.planning_days == 1:
+            return ""
+        dates = planning_dates(state["current_time"], self.planning_days)
+        return prompt.format(
+            days=self.planning_days, first_day=dates[0], last_day=dates[-1]
+        )
+
+    def create_events(self, state: ScheduleState) -> Dict[str, Any]:
+        """Save the events of the structured schedule in the calendar, without an LLM.
+
+        The planned events of the window are reconciled with the schedule, so
+        planning again only moves, creates and deletes what changed. What starts
+        before the current time is left as it is.
+        """
+        schedule = state.get("structured_schedule")
+        if schedule is None:
+            error = "The schedule is not valid, no events were created"
+            return {"messages": [AIMessage(content=error)], "errors": [error]}
+
+        now = getDateTimeFromISO8601String(state["current_time"])
+        window_end = local_datetime(
+            now.date() + timedelta(days=self.planning_days), datetime.min.time()
+        )
+        planned = list_planned_events(now.isoformat(), window_end.isoformat())
+
+        def key(summary: str, start: str, end: str) -> tuple:
+            return (
+                summary,
+                getDateTimeFromISO8601String(start),
+                getDateTimeFromISO8601String(end),
+            )
+
+        # Events that already started are neither moved nor deleted
+        planned = [
+            event
+            for event in planned
+            if "dateTime" in event["start"]
+            and getDateTimeFromISO8601String(event["start"]["dateTime"]) >= now
+        ]
+
+        # Events of the user are never created again, the planned ones are kept
+        planned_ids = {event["id"] for event in planned}
+        planned_keys = {
+            key(
+                event.get("summary"),
+                event["start"].get("dateTime", event["start"].get("date")),
+                event["end"].get("dateTime", event["end"].get("date")),
+            )
+            for event in planned
+        }
+        user_events = {
+            key(event.summary, event.start, event.end)
+            for calendar in state["events"].events
+            for event in list(calendar.values())[0]
+            if event.id not in planned_ids
+        }
+        events = []
+        for entry in schedule.entries:
+            entry_key = key(entry.summary, entry.start, entry.end)
+            # Entries before now are already in the calendar or in the past
+            if entry_key in user_events or entry_key[1] < now:
+                continue
+            if not entry.fixed or entry_key in planned_keys:
+                events.append(
+                    {
+                        "summary": entry.summary,
+                        "start_time": entry.start,
+                        "end_time": entry.end,
+                    }
+                )
+
+        results = upsert_planned_events(
+            events,
+            now.isoformat(),
+            window_end.isoformat(),
+            delete=True,
+            planned=planned,
+        )
+        errors = [
+            f"Event {result.get('summary')}: {result['error']}"
+            for result in results
+            if "error" in result
+        ]
+        message = f"Planned {len(events) - len(errors)} of {len(events)} events"
+        return {"messages": [AIMessage(content=message)], "errors": errors}
+
     def confirm_schedule(self, state: ScheduleState) -> bool:
         """Check if the schedule needs to be rewritten based on the review"""
         return (
@@ -250,20 +721,20 @@ class Agent:
         }
 
     def call_llm(self, state: ScheduleState) -> Dict[str, Any]:
-        messages = state["messages"]
+        max_tokens = self.max_input_tokens
+        messages = fit_messages(state["messages"], max_tokens)
         invoked_successful = False
         while not invoked_successful:
             try:
-                message = self.model.invoke(messages)
+                message = self.invoke_model(self.model, messages)
                 invoked_successful = True
             except openai.UnprocessableEntityError:
+                # The token estimate fell short, fit the messages in a smaller budget
+                if max_tokens <= self.max_input_tokens // 4:
+                    raise
                 print("Reducing input messages...")
-                messages = messages[1:]
-                state["messages"] = messages
-            except openai.RateLimitError as error:
-                print(error)
-                print("waiting...")
-                time.sleep(20)
+                max_tokens //= 2
+                messages = fit_messages(state["messages"], max_tokens)
 
         return {"messages": [message]}
 
@@ -271,23 +742,158 @@ class Agent:
         result = state["messages"][-1]
         return len(result.tool_calls) > 0
 
-    def take_action(self, state: ScheduleState) -> Dict[str, list]:
+    def take_action(
+        self, state: ScheduleState, config: RunnableConfig
+    ) -> Dict[str, list]:
         tool_calls = state["messages"][-1].tool_calls
-        results = []
+        thread_id = config.get("configurable", {}).get("thread_id")
+
+        # Consecutive parallel-safe calls run together, the others one at a time
+        groups = []
         for t in tool_calls:
-            print(f"Calling: {t}")
-            result = self.tools[t["name"]].invoke(t["args"])
-            results.append(
-                ToolMessage(tool_call_id=t["id"], name=t["name"], content=str(result))
+            tool = self.tools.get(t["name"])
+            parallel = tool is not None and is_parallel_safe(tool)
+            if parallel and groups and groups[-1][0]:
+                groups[-1][1].append(t)
+            else:
+                groups.append((parallel, [t]))
+
+        results = []
+        for parallel, calls in groups:
+            outputs = run_concurrently(
+                lambda tool_call: self.call_tool(tool_call, thread_id),
+                calls,
+                max_workers=self.max_workers if parallel else 1,
+                timeout=self.tool_timeout,
             )
+            for t, (result, error) in zip(calls, outputs):
+                if error is not None:
+                    print(f"Tool {t['name']} failed: {error}")
+                    results.append(
+                        ToolMessage(
+                            tool_call_id=t["id"],
+                            name=t["name"],
+                            content=f"Error: {error}",
+                            status="error",
+                        )
+                    )
+                else:
+                    results.append(
+                        ToolMessage(
+                            tool_call_id=t["id"], name=t["name"], content=str(result)
+                        )
+                    )
         print("Back to the model!")
         return {"messages": results}
 
+    def call_tool(
+        self, tool_call: Dict[str, Any], thread_id: str | None = None
+    ) -> Any:
+        print(f"Calling: {tool_call}")
+        name, args = tool_call["name"], tool_call["args"]
+        if name not in self.tools:
+            raise ValueError(f"Unknown tool '{name}'")
+
+        if self.ledger is None or thread_id is None or name not in EVENT_TOOLS:
+            return self.tools[name].invoke(args)
+
+        # Only create the events that this thread has not created yet
+        events = args["calendar_events"] if name == "create_calendar_events" else [args]
+        results = [self.ledger.get(thread_id, event) for event in events]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if len(pending) < len(events):
+            print(f"Skipping {len(events) - len(pending)} events already created")
+
+        if pending:
+            if name == "create_calendar_events":
+                pending_events = [events[i] for i in pending]
+                created = self.tools[name].invoke({"calendar_events": pending_events})
+            else:
+                created = [self.tools[name].invoke(args)]
+            for i, result in zip(pending, created):
+                results[i] = result
+                if "error" not in result:
+                    self.ledger.record(thread_id, events[i], result)
+
+        return results if name == "create_calendar_events" else results[0]
+
+    def stream(
+        self, thread_id: str | None = None, config: Dict[str, Any] | None = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Run the graph and yield the updates of its nodes.
+
+        With a checkpointer, the state is saved after each node under the thread
+        id. Streaming a thread that did not finish resumes it from its last
+        completed node. A summary of the timings is printed at the end.
+
+        Args:
+            thread_id (str): Id of the run. A new one is created if not given.
+            config (dict): Config of the graph run, e.g. callbacks.
+        """
+        config = {"recursion_limit": 100, **(config or {})}
+        inputs = {"messages": []}
+
+        if self.checkpointer is not None:
+            thread_id = thread_id or str(uuid.uuid4())
+            print(f"Run id: {thread_id}")
+        if thread_id is not None:
+            config["configurable"] = {
+                **config.get("configurable", {}),
+                "thread_id": thread_id,
+            }
+
+        if self.checkpointer is not None:
+            snapshot = self.graph.get_state(config)
+            if snapshot.next:
+                print(f"Resuming run '{thread_id}' from {', '.join(snapshot.next)}")
+                inputs = None
+            elif snapshot.values:
+                print(f"Run '{thread_id}' already finished")
+                return
+
+        # The events planned by the run are tagged with its id
+        with metrics.track_run() as run, use_plan_run(thread_id or str(uuid.uuid4())):
+            yield from self.graph.stream(inputs, config=config)
+        print(run)
+
+
+def create_model():
+    # Initialize our LLM
+    # model = ChatOllama(model="llama3.1:8b", temperature=0, max_tokens=4000)
+    return ChatTogether(
+        model="meta-llama/Llama-3.3-70B-Instruct-Turbo-Free",
+        temperature=0,
+        max_tokens=4000,
+        # The rate limiter of the agent is the only one retrying the requests
+        max_retries=0,
+    )
 
-def run_agent() -> None:
-    for event in agent.graph.stream(
-        {"messages": messages},
-        config={"callbacks": [langfuse_handler], "recursion_limit": 100},
+
+def create_agent(model=None, **kwargs) -> Agent:
+    """Create the agent with the default tools and caches.
+
+    Args:
+        model: Chat model of the agent, a new one from create_model by default.
+        **kwargs: Other arguments of Agent, e.g. planning_mode.
+    """
+    tools = [
+        get_current_time,
+        get_date_in_iso_format,
+        sum_to_date,
+        create_calendar_event,
+        create_calendar_events,
+    ]
+    # The default caches are only created (and their files) when not given
+    if "sync_cache" not in kwargs:
+        kwargs["sync_cache"] = SyncCache()
+    if "reading_time_cache" not in kwargs:
+        kwargs["reading_time_cache"] = ReadingTimeCache()
+    return Agent(model or create_model(), tools, system=AGENT_SYSTEM, **kwargs)
+
+
+def run_agent(thread_id: str | None = None) -> None:
+    for event in agent.stream(
+        thread_id, config={"callbacks": [langfuse_handler], "recursion_limit": 100}
     ):
         for v in event.values():
             if v and "messages" in v:
@@ -297,6 +903,30 @@ def run_agent() -> None:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan the day with the AI scheduler")
+    parser.add_argument(
+        "--thread-id",
+        help="Id of the run, pass the id of an interrupted run to resume it",
+    )
+    parser.add_argument(
+        "--candidates",
+        type=int,
+        default=1,
+        help="Number of schedules generated concurrently, the best one is kept",
+    )
+    parser.add_argument(
+        "--structured",
+        action="store_true",
+        help="Create the events of the schedule directly, without the event creator LLM",
+    )
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=1,
+        help=f"Number of days to plan starting today, up to {MAX_PLANNING_DAYS}",
+    )
+    args = parser.parse_args()
+
     langfuse = Langfuse(
         secret_key=os.getenv("LANGFUSE_SECRET_KEY"),
         public_key=os.getenv("LANGFUSE_PUBLIC_KEY"),
@@ -304,27 +934,12 @@ if __name__ == "__main__":
     )
     langfuse_handler = CallbackHandler()
 
-    # Initialize our LLM
-    # model = ChatOllama(model="llama3.1:8b", temperature=0, max_tokens=4000)
-    model = ChatTogether(
-        model="meta-llama/Llama-3.3-70B-Instruct-Turbo-Free",
-        temperature=0,
-        max_tokens=4000,
-    )
-
-    tools = [
-        get_current_time,
-        get_date_in_iso_format,
-        sum_to_date,
-        create_calendar_event,
-        create_calendar_events,
-    ]
-    agent = Agent(
-        model,
-        tools,
-        checkpointer=None,
-        system=AGENT_SYSTEM,
+    agent = create_agent(
+        checkpointer=create_checkpointer(),
+        ledger=CreatedEventsLedger(),
+        planning_days=args.days,
+        candidates=args.candidates,
+        structured=args.structured,
     )
-    messages = []
 
-    run_agent()
+    run_agent(args.thread_id)
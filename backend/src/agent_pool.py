@@ -0,0 +1,82 @@
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+import threading
+import os
+
+from src.agent import Agent, create_agent, create_model
+from src.cache import SyncCache, use_sync_cache
+from src.cache.sync_cache import SYNC_CACHE_FILE
+from src.tools import GoogleServices, GoogleServicesCache, use_services, use_calendar
+
+
+class AgentPool:
+    """Agents and Google services shared by all the users of the process.
+
+    The agents are stateless between runs, so each configuration is created
+    and compiled once and its graph is run concurrently for every user. All
+    of them share the same model client and its HTTP connections. The Google
+    services of each user are kept in a bounded cache and selected for the
+    duration of a run with user(), together with the sync cache of the user
+    (token_dir/<user_id>/sync_cache.sqlite3) and the calendar of the run. The
+    single user setup (token.json and CALENDAR_ID) selects its sync cache with
+    default_user().
+    """
+
+    def __init__(
+        self,
+        model_factory: Callable[[], Any] = create_model,
+        max_users: int = 128,
+        token_dir: str = "tokens",
+    ) -> None:
+        self.model_factory = model_factory
+        self.token_dir = token_dir
+        self.services = GoogleServicesCache(max_size=max_users, token_dir=token_dir)
+        self._model = None
+        self._sync_cache = None
+        self._agents: dict[tuple, Agent] = {}
+        self._lock = threading.Lock()
+
+    def get_agent(self, **kwargs) -> Agent:
+        """Get the agent for the given Agent arguments, creating it on first use."""
+        key = tuple(sorted(kwargs.items()))
+        with self._lock:
+            if key not in self._agents:
+                if self._model is None:
+                    self._model = self.model_factory()
+                # The sync cache is selected per run, in user() or default_user()
+                self._agents[key] = create_agent(
+                    model=self._model, sync_cache=None, **kwargs
+                )
+            return self._agents[key]
+
+    @contextmanager
+    def default_user(self) -> Iterator[SyncCache]:
+        """Use the sync cache of the single user setup for the runs inside the block."""
+        with self._lock:
+            if self._sync_cache is None:
+                self._sync_cache = SyncCache()
+        with use_sync_cache(self._sync_cache):
+            yield self._sync_cache
+
+    @contextmanager
+    def user(
+        self, user_id: str, calendar_id: str | None = None
+    ) -> Iterator[GoogleServices]:
+        """Use the Google services and cache of a user for the runs inside the block.
+
+        Args:
+            user_id (str): Id of the user.
+            calendar_id (str): Calendar where the events are created, the
+                default one of the user when not given.
+        """
+        # Validates the user id, which is used as directory name
+        services = self.services.get(user_id)
+        user_dir = os.path.join(self.token_dir, user_id)
+        os.makedirs(user_dir, exist_ok=True)
+        sync_cache = SyncCache(os.path.join(user_dir, SYNC_CACHE_FILE))
+        with (
+            use_services(services),
+            use_sync_cache(sync_cache),
+            use_calendar(calendar_id),
+        ):
+            yield services
@@ -0,0 +1,302 @@
+"""Plan the day of many users in a single run.
+
+The users are planned concurrently in a pool of worker processes. Each user
+has its own Google services, caches, checkpoints and log under the output
+directory. The LLM requests of all the workers share a concurrency limit and
+the requests per minute are split between the workers.
+
+Usage, from the backend directory:
+    python -m src.batch profiles.json --workers 8 --llm-concurrency 4
+
+The profiles file is a JSON list of users:
+    [{"user_id": "alice", "token_file": "tokens/alice.json", "calendar_id": "..."}]
+
+Runs are identified by the user and the date, so running the batch again on the
+same day skips the users already planned and resumes the ones that failed.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from datetime import date
+from typing import Any, Callable, Dict, List
+import multiprocessing
+import traceback
+import argparse
+import json
+import time
+import os
+import sys
+
+from pydantic import BaseModel, Field, field_validator
+
+from src.agent import create_agent, create_model, PLANNING_MODES, MAX_PLANNING_DAYS
+from src.cache import SyncCache, ReadingTimeCache
+from src.checkpoint import create_checkpointer, CreatedEventsLedger
+from src.llm import RateLimiter
+from src.tools import GoogleServices, use_services
+from src.tools.google_services import USER_ID_REGEX, PRIMARY_CALENDAR
+
+OUTPUT_DIR = "batch_runs"
+# LLM requests in flight across all the workers
+LLM_CONCURRENCY = 4
+# LLM requests per minute across all the workers
+REQUESTS_PER_MINUTE = 60
+
+
+class UserProfile(BaseModel):
+    user_id: str = Field(..., description="Id of the user, used as directory name")
+    token_file: str = Field(..., description="File with the Google token of the user")
+    # Never the CALENDAR_ID of the environment, which is the one of the operator
+    calendar_id: str = Field(
+        PRIMARY_CALENDAR,
+        description="Calendar where the events are created, the primary one by default",
+    )
+
+    @field_validator("user_id")
+    @classmethod
+    def check_user_id(cls, value: str) -> str:
+        if not USER_ID_REGEX.fullmatch(value):
+            raise ValueError(f"Invalid user id '{value}'")
+        return value
+
+
+def load_profiles(path: str) -> List[UserProfile]:
+    """Read the user profiles of a JSON file, user ids must be unique."""
+    with open(path) as file:
+        profiles = [UserProfile.model_validate(profile) for profile in json.load(file)]
+    user_ids = [profile.user_id for profile in profiles]
+    duplicates = sorted(
+        {user_id for user_id in user_ids if user_ids.count(user_id) > 1}
+    )
+    if duplicates:
+        raise ValueError(f"Duplicated user ids: {', '.join(duplicates)}")
+    return profiles
+
+
+def profile_services(profile: UserProfile) -> GoogleServices:
+    """Google services of a user, without the browser authorization flow."""
+    return GoogleServices(
+        token_file=profile.token_file,
+        calendar_id=profile.calendar_id,
+        interactive=False,
+    )
+
+
+# Objects shared by the runs of a worker process, set by _init_worker
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(
+    semaphore,
+    requests_per_minute: float,
+    output_dir: str,
+    model_factory: Callable[[], Any],
+    services_factory: Callable[[UserProfile], GoogleServices],
+    agent_options: Dict[str, Any],
+) -> None:
+    _worker.update(
+        # One model client per process, shared by all its users
+        model=model_factory(),
+        rate_limiter=RateLimiter(
+            requests_per_minute=requests_per_minute, semaphore=semaphore
+        ),
+        # Reading times do not depend on the user
+        reading_time_cache=ReadingTimeCache(
+            os.path.join(output_dir, "reading_time_cache.sqlite3")
+        ),
+        output_dir=output_dir,
+        services_factory=services_factory,
+        agent_options=agent_options,
+    )
+
+
+def plan_user(profile: UserProfile, run_date: str) -> Dict[str, Any]:
+    """Plan the day of a user in a worker process.
+
+    The output of the agent is written to the log of the user. Failures are
+    returned in the result instead of raised, so one user does not stop the
+    batch.
+    """
+    user_dir = os.path.join(_worker["output_dir"], profile.user_id)
+    os.makedirs(user_dir, exist_ok=True)
+    start = time.perf_counter()
+    result = {"user_id": profile.user_id, "ok": True, "errors": []}
+
+    services, checkpointer = None, None
+    with open(os.path.join(user_dir, "run.log"), "a") as log, redirect_stdout(log):
+        print(f"\n=== {run_date} ===")
+        try:
+            services = _worker["services_factory"](profile)
+            checkpointer = create_checkpointer(
+                os.path.join(user_dir, "checkpoints.sqlite3")
+            )
+            agent = create_agent(
+                model=_worker["model"],
+                sync_cache=SyncCache(os.path.join(user_dir, "sync_cache.sqlite3")),
+                reading_time_cache=_worker["reading_time_cache"],
+                rate_limiter=_worker["rate_limiter"],
+                checkpointer=checkpointer,
+                ledger=CreatedEventsLedger(
+                    os.path.join(user_dir, "checkpoints.sqlite3")
+                ),
+                **_worker["agent_options"],
+            )
+            with use_services(services):
+                for update in agent.stream(f"{profile.user_id}-{run_date}"):
+                    for values in update.values():
+                        if values:
+                            # Sources that could not be fetched or events not created
+                            result["errors"] += values.get("errors", [])
+        except Exception as e:
+            traceback.print_exc(file=log)
+            result.update(ok=False, error=f"{type(e).__name__}: {e}")
+        finally:
+            if services is not None:
+                services.close()
+            if checkpointer is not None:
+                checkpointer.conn.close()
+
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def run_batch(
+    profiles: List[UserProfile],
+    workers: int | None = None,
+    llm_concurrency: int = LLM_CONCURRENCY,
+    requests_per_minute: float = REQUESTS_PER_MINUTE,
+    output_dir: str = OUTPUT_DIR,
+    model_factory: Callable[[], Any] = create_model,
+    services_factory: Callable[[UserProfile], GoogleServices] = profile_services,
+    **agent_options,
+) -> Dict[str, Any]:
+    """Plan the day of every user in a pool of worker processes.
+
+    Args:
+        profiles (list): Users to plan.
+        workers (int): Worker processes. Defaults to the number of CPUs.
+        llm_concurrency (int): LLM requests in flight across all the workers.
+        requests_per_minute (float): LLM requests per minute across all the
+            workers, each worker gets an equal share.
+        output_dir (str): Directory with the caches, checkpoints and logs of
+            every user, and the summary of the batch.
+        model_factory: Creates the chat model of each worker.
+        services_factory: Creates the Google services of a user.
+        **agent_options: Other arguments of Agent, e.g. planning_days.
+
+    Returns:
+        dict: Summary of the batch with the result of every user.
+    """
+    workers = min(workers or os.cpu_count() or 1, max(len(profiles), 1))
+    os.makedirs(output_dir, exist_ok=True)
+    run_date = date.today().isoformat()
+    context = multiprocessing.get_context()
+    semaphore = context.BoundedSemaphore(llm_concurrency)
+
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(
+            semaphore,
+            requests_per_minute / workers,
+            output_dir,
+            model_factory,
+            services_factory,
+            agent_options,
+        ),
+    ) as executor:
+        futures = {
+            executor.submit(plan_user, profile, run_date): profile
+            for profile in profiles
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process died, e.g. killed for using too much memory
+                result = {
+                    "user_id": futures[future].user_id,
+                    "ok": False,
+                    "errors": [],
+                    "error": f"{type(e).__name__}: {e}",
+                }
+            results.append(result)
+            status = f"done in {result['seconds']}s" if result["ok"] else "FAILED"
+            print(f"[{done}/{len(profiles)}] {result['user_id']}: {status}", flush=True)
+
+    results.sort(key=lambda result: result["user_id"])
+    summary = {
+        "date": run_date,
+        "users": len(profiles),
+        "succeeded": sum(result["ok"] for result in results),
+        "failed": [result for result in results if not result["ok"]],
+        "seconds": round(time.perf_counter() - start, 3),
+        "results": results,
+    }
+    with open(os.path.join(output_dir, f"summary-{run_date}.json"), "w") as file:
+        json.dump(summary, file, indent=2)
+    return summary
+
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    print(
+        f"\nPlanned {summary['succeeded']} of {summary['users']} users "
+        f"in {summary['seconds']}s"
+    )
+    for result in summary["results"]:
+        if result["ok"] and result["errors"]:
+            print(f"  {result['user_id']}: {len(result['errors'])} errors")
+            for error in result["errors"]:
+                print(f"    {error}")
+    if summary["failed"]:
+        print("Failed users:")
+        for result in summary["failed"]:
+            print(f"  {result['user_id']}: {result['error']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan the day of many users")
+    parser.add_argument("profiles", help="JSON file with the user profiles")
+    parser.add_argument(
+        "--workers", type=int, help="Worker processes, the number of CPUs by default"
+    )
+    parser.add_argument(
+        "--llm-concurrency",
+        type=int,
+        default=LLM_CONCURRENCY,
+        help="LLM requests in flight across all the workers",
+    )
+    parser.add_argument(
+        "--requests-per-minute",
+        type=float,
+        default=REQUESTS_PER_MINUTE,
+        help="LLM requests per minute across all the workers",
+    )
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--planning-mode", choices=PLANNING_MODES, default="llm")
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=1,
+        help=f"Number of days to plan starting today, up to {MAX_PLANNING_DAYS}",
+    )
+    parser.add_argument("--candidates", type=int, default=1)
+    parser.add_argument("--structured", action="store_true")
+    args = parser.parse_args()
+
+    summary = run_batch(
+        load_profiles(args.profiles),
+        workers=args.workers,
+        llm_concurrency=args.llm_concurrency,
+        requests_per_minute=args.requests_per_minute,
+        output_dir=args.output_dir,
+        planning_mode=args.planning_mode,
+        planning_days=args.days,
+        candidates=args.candidates,
+        structured=args.structured,
+    )
+    print_summary(summary)
+    sys.exit(1 if summary["failed"] else 0)
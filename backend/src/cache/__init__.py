@@ -0,0 +1,3 @@
+from .sync_cache import SyncCache, use_sync_cache, get_sync_cache
+from .reading_time_cache import ReadingTimeCache
+from .response_cache import ResponseCache, response_cache_key
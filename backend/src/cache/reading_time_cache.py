@@ -0,0 +1,87 @@
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+import sqlite3
+import time
+
+READING_TIME_CACHE_FILE = "reading_time_cache.sqlite3"
+# Seconds during which a cached reading time is used without revalidating it
+READING_TIME_TTL = 7 * 24 * 60 * 60
+
+
+class ReadingTimeCache:
+    """SQLite store of the reading time of web pages keyed by URL.
+
+    Entries younger than the TTL are used as they are. Older ones keep the
+    ETag and Last-Modified headers of the page so they can be revalidated
+    with a conditional request instead of downloading the page again.
+    """
+
+    def __init__(
+        self, path: str = READING_TIME_CACHE_FILE, ttl: float = READING_TIME_TTL
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        with self._connect() as connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS reading_times (
+                    url TEXT PRIMARY KEY,
+                    time TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetched_at REAL NOT NULL
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # One connection per operation, so the cache can be used from many threads
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, url: str) -> Dict[str, Any] | None:
+        """Get the cached entry of a URL, fresh or not."""
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT time, etag, last_modified, fetched_at FROM reading_times "
+                "WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "time": row[0],
+            "etag": row[1],
+            "last_modified": row[2],
+            "fetched_at": row[3],
+        }
+
+    def is_fresh(self, entry: Dict[str, Any]) -> bool:
+        """Whether an entry can be used without revalidating it."""
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    def save(
+        self,
+        url: str,
+        reading_time: str,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO reading_times VALUES (?, ?, ?, ?, ?)",
+                (url, reading_time, etag, last_modified, time.time()),
+            )
+
+    def touch(self, url: str) -> None:
+        """Mark an entry as fresh after the page was revalidated as not modified."""
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE reading_times SET fetched_at = ? WHERE url = ?",
+                (time.time(), url),
+            )
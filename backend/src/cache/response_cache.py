@@ -0,0 +1,122 @@
+from contextlib import contextmanager
+from typing import Any, Iterator
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+
+from langchain_core.messages import (
+    AIMessage,
+    AnyMessage,
+    message_to_dict,
+    messages_from_dict,
+    messages_to_dict,
+)
+
+RESPONSE_CACHE_FILE = "response_cache.sqlite3"
+# Maximum size of the cached responses, the least recently used are evicted
+RESPONSE_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+
+def _model_fingerprint(model) -> dict[str, Any]:
+    """Get the id and parameters of a chat model, including the bound ones."""
+    kwargs = {}
+    # Models configured with .bind(...) are wrapped in a RunnableBinding
+    while hasattr(model, "bound"):
+        kwargs = {**getattr(model, "kwargs", {}), **kwargs}
+        model = model.bound
+    return {
+        "model": type(model).__name__,
+        "params": getattr(model, "_identifying_params", {}),
+        "kwargs": kwargs,
+    }
+
+
+def response_cache_key(model, messages: list[AnyMessage]) -> str:
+    """Hash of the model id, its parameters and the serialized messages."""
+    payload = json.dumps(
+        {"model": _model_fingerprint(model), "messages": messages_to_dict(messages)},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Disk-backed LRU cache of the LLM responses, keyed by the request content.
+
+    Only worth it for deterministic calls (temperature 0). The cached responses
+    are stored in SQLite and the least recently used ones are evicted once the
+    total size goes over max_bytes.
+    """
+
+    def __init__(
+        self,
+        path: str = RESPONSE_CACHE_FILE,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        with self._connect() as connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, key: str) -> AIMessage | None:
+        with self._lock, self._connect() as connection:
+            row = connection.execute(
+                "SELECT data FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?",
+                (time.time(), key),
+            )
+        return messages_from_dict([json.loads(row[0])])[0]
+
+    def put(self, key: str, message: AIMessage) -> None:
+        data = json.dumps(message_to_dict(message))
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()),
+            )
+            self._evict(connection)
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        """Delete the least recently used responses until the cache fits in max_bytes."""
+        total = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = connection.execute(
+            "SELECT key, size FROM responses ORDER BY last_access"
+        ).fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
@@ -0,0 +1,201 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List
+import sqlite3
+import json
+
+SYNC_CACHE_FILE = "sync_cache.sqlite3"
+
+
+class SyncCache:
+    """SQLite store of the Google Calendar events and Google Tasks of the user.
+
+    For each calendar it keeps the events of the synced time window and the
+    sync token returned by Google, and for each task list the open tasks and
+    the time of the last sync, so later runs only need to request the changes.
+    """
+
+    def __init__(self, path: str = SYNC_CACHE_FILE) -> None:
+        self.path = path
+        with self._connect() as connection:
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS calendar_sync (
+                    calendar_id TEXT PRIMARY KEY,
+                    window_start TEXT NOT NULL,
+                    window_end TEXT NOT NULL,
+                    sync_token TEXT
+                );
+                CREATE TABLE IF NOT EXISTS calendar_events (
+                    calendar_id TEXT NOT NULL,
+                    event_id TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (calendar_id, event_id)
+                );
+                CREATE TABLE IF NOT EXISTS task_sync (
+                    task_list_id TEXT PRIMARY KEY,
+                    updated_min TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_list_id TEXT NOT NULL,
+                    task_id TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (task_list_id, task_id)
+                );
+                """
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # One connection per operation, so the cache can be used from many threads
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    # Calendar events
+    def get_calendar_sync(self, calendar_id: str) -> Dict[str, str] | None:
+        """Get the window and sync token of the last sync of a calendar."""
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT window_start, window_end, sync_token FROM calendar_sync "
+                "WHERE calendar_id = ?",
+                (calendar_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"window_start": row[0], "window_end": row[1], "sync_token": row[2]}
+
+    def get_calendar_events(self, calendar_id: str) -> List[Dict[str, Any]]:
+        """Get the cached events of a calendar as returned by the Calendar API."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT data FROM calendar_events WHERE calendar_id = ?",
+                (calendar_id,),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def save_calendar_events(
+        self,
+        calendar_id: str,
+        items: List[Dict[str, Any]],
+        sync_token: str | None,
+        window_start: str,
+        window_end: str,
+        full_sync: bool,
+    ) -> None:
+        """Store the events of a full sync or apply the changes of an incremental one.
+
+        Args:
+            calendar_id (str): ID of the calendar.
+            items (list): Events returned by the Calendar API.
+            sync_token (str): Token to request the next changes.
+            window_start (str): Start of the synced time window in ISO format.
+            window_end (str): End of the synced time window in ISO format.
+            full_sync (bool): Whether the items replace all the cached events.
+        """
+        with self._connect() as connection:
+            if full_sync:
+                connection.execute(
+                    "DELETE FROM calendar_events WHERE calendar_id = ?", (calendar_id,)
+                )
+            for item in items:
+                if item.get("status") == "cancelled":
+                    connection.execute(
+                        "DELETE FROM calendar_events "
+                        "WHERE calendar_id = ? AND event_id = ?",
+                        (calendar_id, item["id"]),
+                    )
+                else:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO calendar_events VALUES (?, ?, ?)",
+                        (calendar_id, item["id"], json.dumps(item)),
+                    )
+            connection.execute(
+                "INSERT OR REPLACE INTO calendar_sync VALUES (?, ?, ?, ?)",
+                (calendar_id, window_start, window_end, sync_token),
+            )
+
+    # Tasks
+    def get_task_sync(self, task_list_id: str) -> str | None:
+        """Get the time of the last sync of a task list in RFC 3339 format."""
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT updated_min FROM task_sync WHERE task_list_id = ?",
+                (task_list_id,),
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_tasks(self, task_list_id: str) -> List[Dict[str, Any]]:
+        """Get the cached open tasks of a task list as returned by the Tasks API."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT data FROM tasks WHERE task_list_id = ?", (task_list_id,)
+            ).fetchall()
+        tasks = [json.loads(row[0]) for row in rows]
+        # Keep the order of the Tasks API
+        return sorted(tasks, key=lambda task: task.get("position", ""))
+
+    def save_tasks(
+        self,
+        task_list_id: str,
+        items: List[Dict[str, Any]],
+        updated_min: str,
+        full_sync: bool,
+    ) -> None:
+        """Store the tasks of a full sync or apply the changes of an incremental one.
+
+        Args:
+            task_list_id (str): ID of the task list.
+            items (list): Tasks returned by the Tasks API.
+            updated_min (str): Time of the sync, the next one requests changes after it.
+            full_sync (bool): Whether the items replace all the cached tasks.
+        """
+        with self._connect() as connection:
+            if full_sync:
+                connection.execute(
+                    "DELETE FROM tasks WHERE task_list_id = ?", (task_list_id,)
+                )
+            for item in items:
+                closed = (
+                    item.get("deleted")
+                    or item.get("hidden")
+                    or item.get("status") == "completed"
+                )
+                if closed:
+                    connection.execute(
+                        "DELETE FROM tasks WHERE task_list_id = ? AND task_id = ?",
+                        (task_list_id, item["id"]),
+                    )
+                else:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO tasks VALUES (?, ?, ?)",
+                        (task_list_id, item["id"], json.dumps(item)),
+                    )
+            connection.execute(
+                "INSERT OR REPLACE INTO task_sync VALUES (?, ?)",
+                (task_list_id, updated_min),
+            )
+
+
+# Cache of the user of the current run, when the agent is shared by many users
+_current_sync_cache: ContextVar[SyncCache | None] = ContextVar(
+    "sync_cache", default=None
+)
+
+
+@contextmanager
+def use_sync_cache(cache: SyncCache) -> Iterator[SyncCache]:
+    """Use the given cache for the runs made inside the block."""
+    token = _current_sync_cache.set(cache)
+    try:
+        yield cache
+    finally:
+        _current_sync_cache.reset(token)
+
+
+def get_sync_cache(default: SyncCache | None = None) -> SyncCache | None:
+    """Get the cache of the current run, or the given one when not set."""
+    return _current_sync_cache.get() or default
@@ -0,0 +1,73 @@
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+import hashlib
+import sqlite3
+import json
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+CHECKPOINT_FILE = "checkpoints.sqlite3"
+
+
+def create_checkpointer(path: str = CHECKPOINT_FILE) -> SqliteSaver:
+    """Create a checkpointer that saves the state of the runs in a SQLite file."""
+    # The graph runs nodes in several threads, SqliteSaver serializes the access
+    return SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+
+
+def event_fingerprint(event: Dict[str, Any]) -> str:
+    """Identify an event by its summary, start and end."""
+    key = json.dumps(
+        [event.get("summary"), event.get("start_time"), event.get("end_time")]
+    )
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class CreatedEventsLedger:
+    """Record of the calendar events created by each run (thread) of the agent.
+
+    Every event is recorded as soon as it is created, so a run that resumes
+    after a crash knows which events it does not have to create again.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_FILE) -> None:
+        self.path = path
+        with self._connect() as connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS created_events (
+                    thread_id TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    PRIMARY KEY (thread_id, fingerprint)
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, thread_id: str, event: Dict[str, Any]) -> Dict[str, Any] | None:
+        """Get the created event if the run already created it."""
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT result FROM created_events "
+                "WHERE thread_id = ? AND fingerprint = ?",
+                (thread_id, event_fingerprint(event)),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def record(
+        self, thread_id: str, event: Dict[str, Any], result: Dict[str, Any]
+    ) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO created_events VALUES (?, ?, ?)",
+                (thread_id, event_fingerprint(event), json.dumps(result, default=str)),
+            )
@@ -0,0 +1,7 @@
+from .context import (
+    fit_messages,
+    count_tokens,
+    count_message_tokens,
+    model_context_window,
+)
+from .rate_limit import RateLimiter, TokenBucket, default_rate_limiter
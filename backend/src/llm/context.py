@@ -0,0 +1,124 @@
+from langchain_core.messages import (
+    AnyMessage,
+    AIMessage,
+    HumanMessage,
+    SystemMessage,
+    ToolMessage,
+)
+import json
+
+from src.models import estimate_tokens
+from src.models.rendering import CHARS_PER_TOKEN
+
+# Tokens added by the chat template to every message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Maximum tokens kept of each compacted tool result
+COMPACT_TOOL_TOKENS = 50
+# Context window in tokens of the known models, by model name
+MODEL_CONTEXT_WINDOWS = {
+    "meta-llama/Llama-3.3-70B-Instruct-Turbo-Free": 131072,
+    "meta-llama/Llama-3.3-70B-Instruct-Turbo": 131072,
+    "llama3.1:8b": 131072,
+}
+# Context window of the models that are not known
+DEFAULT_CONTEXT_WINDOW = 8192
+
+
+def model_context_window(model) -> int:
+    """Get the context window of a chat model, in tokens.
+
+    The context set in the model (num_ctx of Ollama) comes first, then the
+    window of the known models and DEFAULT_CONTEXT_WINDOW for the others.
+    """
+    num_ctx = getattr(model, "num_ctx", None)
+    if num_ctx:
+        return num_ctx
+    name = getattr(model, "model_name", None) or getattr(model, "model", None)
+    return MODEL_CONTEXT_WINDOWS.get(name, DEFAULT_CONTEXT_WINDOW)
+
+
+def count_message_tokens(message: AnyMessage) -> int:
+    """Estimate the number of tokens a message takes in the prompt."""
+    content = message.content
+    if not isinstance(content, str):
+        content = json.dumps(content)
+    tokens = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    if isinstance(message, AIMessage) and message.tool_calls:
+        tool_calls = [call["args"] for call in message.tool_calls]
+        tokens += estimate_tokens(json.dumps(tool_calls))
+    return tokens
+
+
+def count_tokens(messages: list[AnyMessage]) -> int:
+    return sum(count_message_tokens(message) for message in messages)
+
+
+def _compact_tool_message(message: ToolMessage) -> ToolMessage:
+    if count_message_tokens(message) <= COMPACT_TOOL_TOKENS + MESSAGE_OVERHEAD_TOKENS:
+        return message
+    content = str(message.content)[: COMPACT_TOOL_TOKENS * CHARS_PER_TOKEN].rstrip()
+    return message.model_copy(update={"content": content + "... [truncated]"})
+
+
+def fit_messages(messages: list[AnyMessage], max_tokens: int) -> list[AnyMessage]:
+    """Fit the messages in a context window of max_tokens.
+
+    The system messages and the first human message (the task given to the
+    model) are always kept. Older tool results are compacted first, and if the
+    messages still do not fit, the oldest turns (an AI message with its tool
+    results) are dropped until they do. The last turn is never dropped.
+
+    Args:
+        messages (list): Conversation with the model.
+        max_tokens (int): Maximum number of tokens of the prompt.
+
+    Returns:
+        list: Messages that fit in the context window, or as close as possible.
+    """
+    if count_tokens(messages) <= max_tokens:
+        return messages
+
+    first_human = next(
+        (i for i, message in enumerate(messages) if isinstance(message, HumanMessage)),
+        None,
+    )
+    protected = {
+        i
+        for i, message in enumerate(messages)
+        if isinstance(message, SystemMessage) or i == first_human
+    }
+
+    # Results of the last tool calls are still needed, only older ones are compacted
+    last_ai = max(
+        (i for i, message in enumerate(messages) if isinstance(message, AIMessage)),
+        default=len(messages),
+    )
+    messages = [
+        _compact_tool_message(message)
+        if isinstance(message, ToolMessage) and i < last_ai
+        else message
+        for i, message in enumerate(messages)
+    ]
+
+    # Split the rest of the conversation in turns that can be dropped together,
+    # so a tool result is never left without the AI message that requested it
+    turns: list[list[int]] = []
+    for i, message in enumerate(messages):
+        if i in protected:
+            continue
+        if isinstance(message, ToolMessage) and turns:
+            turns[-1].append(i)
+        else:
+            turns.append([i])
+
+    dropped = set()
+    total = count_tokens(messages)
+    for turn in turns[:-1]:
+        if total <= max_tokens:
+            break
+        dropped.update(turn)
+        total -= sum(count_message_tokens(messages[i]) for i in turn)
+
+    if dropped:
+        print(f"Dropped {len(dropped)} old messages to fit the context window")
+    return [message for i, message in enumerate(messages) if i not in dropped]
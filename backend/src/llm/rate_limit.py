@@ -0,0 +1,128 @@
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Any
+import threading
+import random
+import time
+
+import openai
+
+from src import metrics
+
+
+class TokenBucket:
+    """Thread-safe token bucket that spaces out requests to a fixed rate."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        """
+        Args:
+            rate (float): Tokens added per second.
+            capacity (float): Maximum number of tokens, i.e. the allowed burst.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take a token, waiting until one is available.
+
+        Returns:
+            float: Seconds waited.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # The token is taken now, callers that arrive later wait behind it
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class RateLimiter:
+    """Rate limit and retry the invocations of the LLM provider.
+
+    Every request takes a token from a bucket sized to the provider limits.
+    Rate limit errors are retried honouring the Retry-After header, or else
+    with exponential backoff and jitter, up to max_retries times. With a
+    semaphore, e.g. a multiprocessing one shared by several processes, the
+    requests in flight are also bounded.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = 60,
+        burst: int = 5,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        semaphore=None,
+    ) -> None:
+        self.bucket = TokenBucket(requests_per_minute / 60, burst)
+        self.semaphore = semaphore
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def invoke(self, runnable, input: Any, **kwargs) -> Any:
+        """Invoke a runnable (e.g. a chat model) within the rate limit."""
+        for attempt in range(self.max_retries + 1):
+            waited = self.bucket.acquire()
+            if waited:
+                metrics.inc("scheduler_llm_rate_limit_wait_seconds_total", waited)
+            try:
+                if self.semaphore is None:
+                    return runnable.invoke(input, **kwargs)
+                with self.semaphore:
+                    return runnable.invoke(input, **kwargs)
+            except openai.RateLimitError as error:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_after(error)
+                if delay is None:
+                    delay = self._backoff(attempt)
+                print(f"Rate limited, retrying in {delay:.1f}s: {error}")
+                metrics.inc("scheduler_llm_retries_total")
+                metrics.inc("scheduler_llm_backoff_seconds_total", delay)
+                time.sleep(delay)
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with jitter, so waiting clients do not retry together."""
+        delay = min(self.max_delay, self.base_delay * 2**attempt)
+        return random.uniform(delay / 2, delay)
+
+    def _retry_after(self, error: openai.RateLimitError) -> float | None:
+        """Get the wait requested by the provider in the Retry-After headers."""
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms:
+            try:
+                return min(float(retry_after_ms) / 1000, self.max_delay)
+            except ValueError:
+                pass
+
+        retry_after = headers.get("retry-after")
+        if not retry_after:
+            return None
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            # Retry-After can also be an HTTP date
+            try:
+                date = parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                return None
+            seconds = (date - datetime.now(timezone.utc)).total_seconds()
+        return min(max(seconds, 0.0), self.max_delay)
+
+
+# Rate limiter shared by all the agents of the process
+default_rate_limiter = RateLimiter()
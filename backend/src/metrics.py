@@ -0,0 +1,281 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, Tuple
+import threading
+import time
+
+# Upper bounds of the histogram buckets, in seconds
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+)
+
+# Type and description of every metric
+METRICS = {
+    "scheduler_run_duration_seconds": (
+        "histogram",
+        "Duration of the runs of the agent",
+    ),
+    "scheduler_node_duration_seconds": ("histogram", "Duration of the graph nodes"),
+    "scheduler_google_request_duration_seconds": (
+        "histogram",
+        "Duration of the Google API requests",
+    ),
+    "scheduler_google_request_errors_total": (
+        "counter",
+        "Google API requests that failed",
+    ),
+    "scheduler_web_fetch_duration_seconds": (
+        "histogram",
+        "Duration of the web page downloads",
+    ),
+    "scheduler_llm_request_duration_seconds": (
+        "histogram",
+        "Duration of the model invocations, retries included",
+    ),
+    "scheduler_llm_tokens_total": ("counter", "Tokens of the model invocations"),
+    "scheduler_llm_retries_total": (
+        "counter",
+        "Model invocations retried after a rate limit error",
+    ),
+    "scheduler_llm_backoff_seconds_total": (
+        "counter",
+        "Seconds waited before retrying the model invocations",
+    ),
+    "scheduler_llm_rate_limit_wait_seconds_total": (
+        "counter",
+        "Seconds waited for the rate limiter before the model invocations",
+    ),
+    "scheduler_cache_requests_total": ("counter", "Cache lookups by cache and result"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    values = ",".join(
+        '{}="{}"'.format(
+            key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for key, value in labels
+    )
+    return "{" + values + "}"
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms, aggregated in the process."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS) -> None:
+        self.buckets = buckets
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        # Count of every bucket, sum and count of the observations
+        self._histograms: Dict[Tuple[str, Labels], list] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Add a value to a counter."""
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Add an observation (e.g. a duration) to a histogram."""
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, (list(buckets), total, count))
+                for key, (buckets, total, count) in self._histograms.items()
+            )
+
+        lines = []
+        described = set()
+
+        def describe(name: str) -> None:
+            if name not in described:
+                kind, description = METRICS.get(name, ("untyped", name))
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+        for (name, labels), (buckets, total, count) in histograms:
+            describe(name)
+            for bound, bucket_count in zip(self.buckets, buckets):
+                bucket_labels = labels + (("le", f"{bound:g}"),)
+                lines.append(
+                    f"{name}_bucket{_format_labels(bucket_labels)} {bucket_count}"
+                )
+            inf_labels = labels + (("le", "+Inf"),)
+            lines.append(f"{name}_bucket{_format_labels(inf_labels)} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+class RunMetrics:
+    """Totals of the metrics recorded during a single run of the agent."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.finished = None
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        # Count and sum of the observations
+        self.timings: Dict[Tuple[str, Labels], list] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float, labels: Labels) -> None:
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Labels) -> None:
+        with self._lock:
+            timing = self.timings.setdefault((name, labels), [0, 0.0])
+            timing[0] += 1
+            timing[1] += value
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def hit_rates(self) -> Dict[str, float]:
+        """Get the hit rate of every cache used in the run."""
+        with self._lock:
+            counters = list(self.counters.items())
+        lookups = {}
+        for (name, labels), value in counters:
+            if name != "scheduler_cache_requests_total":
+                continue
+            labels = dict(labels)
+            hits, total = lookups.get(labels["cache"], (0, 0))
+            hit = labels["result"] in ("hit", "revalidated")
+            lookups[labels["cache"]] = (hits + value * hit, total + value)
+        return {cache: hits / total for cache, (hits, total) in lookups.items()}
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Get the summary of the run as JSON serializable values."""
+        with self._lock:
+            timings = sorted(self.timings.items())
+            counters = sorted(self.counters.items())
+        return {
+            "seconds": round(self.elapsed, 3),
+            "timings": [
+                {
+                    "metric": name,
+                    "labels": dict(labels),
+                    "count": count,
+                    "seconds": round(total, 3),
+                }
+                for (name, labels), (count, total) in timings
+            ],
+            "counters": [
+                {"metric": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in counters
+            ],
+            "cache_hit_rates": {
+                cache: round(rate, 3) for cache, rate in self.hit_rates().items()
+            },
+        }
+
+    def __str__(self) -> str:
+        with self._lock:
+            timings = sorted(self.timings.items(), key=lambda item: -item[1][1])
+            counters = sorted(self.counters.items())
+
+        lines = [f"Run finished in {self.elapsed:.2f}s"]
+        for (name, labels), (count, total) in timings:
+            name = name.removeprefix("scheduler_").removesuffix("_seconds")
+            name += _format_labels(labels)
+            lines.append(f"  {name:<64} {count:>4}x {total:>8.3f}s")
+        for (name, labels), value in counters:
+            name = name.removeprefix("scheduler_") + _format_labels(labels)
+            lines.append(f"  {name:<64} {value:>10g}")
+        for cache, rate in self.hit_rates().items():
+            lines.append(f"  {cache} cache hit rate: {rate:.0%}")
+        return "\n".join(lines)
+
+
+# Metrics of the whole process
+registry = MetricsRegistry()
+# Metrics of the run of the current context, if it is being tracked
+_current_run: ContextVar[RunMetrics | None] = ContextVar("run_metrics", default=None)
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """Add a value to a counter of the process and the current run."""
+    registry.inc(name, value, **labels)
+    run = _current_run.get()
+    if run is not None:
+        run.inc(name, value, _labels(labels))
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """Add an observation to a histogram of the process and the current run."""
+    registry.observe(name, value, **labels)
+    run = _current_run.get()
+    if run is not None:
+        run.observe(name, value, _labels(labels))
+
+
+@contextmanager
+def timer(name: str, **labels) -> Iterator[None]:
+    """Observe the duration of the block, also when it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed_node(name: str, func: Callable) -> Callable:
+    """Wrap a graph node to observe its duration."""
+
+    # wraps keeps the signature, LangGraph only passes the config to nodes
+    # that take it
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with timer("scheduler_node_duration_seconds", node=name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def track_run() -> Iterator[RunMetrics]:
+    """Collect the metrics recorded in the block, including its worker threads."""
+    run = RunMetrics()
+    token = _current_run.set(run)
+    try:
+        yield run
+    finally:
+        _current_run.reset(token)
+        run.finished = time.perf_counter()
+        registry.observe("scheduler_run_duration_seconds", run.elapsed)
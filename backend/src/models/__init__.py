@@ -5,4 +5,13 @@ from .models import (
     TaskModel,
     CalendarEventList,
     TasksList,
+    ScheduleEntry,
+    Schedule,
+)
+from .rendering import (
+    RenderOptions,
+    render_current_time,
+    render_events,
+    render_tasks,
+    estimate_tokens,
 )
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field, model_validator
-from src.utils import parse_iso_date
+from pydantic import BaseModel, Field, field_validator, model_validator
+from src.utils import parse_iso_date, getDateTimeFromISO8601String
+from src.utils.time_utils import timezone
 from typing import Any
 
 
@@ -21,7 +22,12 @@ class CalendarEvent(BaseModel):
     end: str = Field(..., description="End time of the event")
 
     def __str__(self) -> str:
-        return f"**{parse_iso_date(self.start)} - {parse_iso_date(self.end)}**: {self.summary}"
+        # In the timezone of the calendar, whatever the offset of the entry
+        start, end = (
+            getDateTimeFromISO8601String(value).astimezone(timezone)
+            for value in (self.start, self.end)
+        )
+        return f"**{start:%Y-%m-%d %H:%M} - {end:%Y-%m-%d %H:%M}**: {self.summary}"
 
     def __repr__(self) -> str:
         return self.__str__()
@@ -119,3 +125,47 @@ class TasksList(BaseModel):
 
     def __repr__(self) -> str:
         return self.__str__()
+
+
+class ScheduleEntry(BaseModel):
+    summary: str = Field(..., description="Summary of the event or task")
+    start: str = Field(..., description="Start time in ISO format")
+    end: str = Field(..., description="End time in ISO format")
+    fixed: bool = Field(
+        False, description="Whether it is an existing event that cannot be moved"
+    )
+
+    @field_validator("start", "end")
+    @classmethod
+    def check_iso_format(cls, value: str) -> str:
+        # The entries of a structured schedule are created as events
+        if getDateTimeFromISO8601String(value).tzinfo is None:
+            raise ValueError(f"'{value}' does not have a UTC offset")
+        return value
+
+    def __str__(self) -> str:
+        # In the timezone of the calendar, whatever the offset of the entry
+        start, end = (
+            getDateTimeFromISO8601String(value).astimezone(timezone)
+            for value in (self.start, self.end)
+        )
+        return f"**{start:%Y-%m-%d %H:%M} - {end:%Y-%m-%d %H:%M}**: {self.summary}"
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+
+class Schedule(BaseModel):
+    entries: list[ScheduleEntry] = Field([], description="Schedule sorted by start time")
+    unscheduled: list[str] = Field(
+        [], description="Tasks that did not fit in the schedule"
+    )
+
+    def __str__(self) -> str:
+        schedule_str = "\n".join([str(entry) for entry in self.entries])
+        if self.unscheduled:
+            schedule_str += "\n\nNot scheduled: " + ", ".join(self.unscheduled)
+        return schedule_str
+
+    def __repr__(self) -> str:
+        return self.__str__()
@@ -0,0 +1,186 @@
+from functools import lru_cache
+from pydantic import BaseModel, Field
+
+from .models import CalendarEventList, TasksList, CalendarEvent, TaskModel
+from src.utils.time_utils import getDateTimeFromISO8601String
+
+# Rough number of characters per token of the LLM tokenizers
+CHARS_PER_TOKEN = 4
+SEPARATOR = "\n\n" + "#" * 20 + "\n\n"
+COMPACT_SEPARATOR = "\n\n"
+
+
+class RenderOptions(BaseModel):
+    compact: bool = Field(
+        False, description="Use short times (HH:MM) and drop repeated information"
+    )
+    max_tasks_per_list: int | None = Field(
+        None, description="Maximum number of tasks shown for each task list"
+    )
+    max_note_tokens: int | None = Field(
+        None, description="Maximum number of tokens of the notes of each task"
+    )
+    token_budget: int | None = Field(
+        None, description="Maximum number of tokens of the rendered tasks"
+    )
+    time_bucket_minutes: int | None = Field(
+        None,
+        description="Round the current time down to a multiple of these minutes, "
+        "(at most 60), so prompts built within the same bucket are identical",
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens of a text."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def render_current_time(
+    current_time: str, options: RenderOptions = RenderOptions()
+) -> str:
+    """Render the current time for a prompt."""
+    if not options.compact and options.time_bucket_minutes is None:
+        return current_time
+
+    date = getDateTimeFromISO8601String(current_time)
+    date = date.replace(second=0, microsecond=0)
+    if options.time_bucket_minutes:
+        bucket = options.time_bucket_minutes
+        date = date.replace(minute=date.minute - date.minute % bucket)
+    return date.isoformat(timespec="minutes")
+
+
+def render_events(
+    events: CalendarEventList, options: RenderOptions = RenderOptions()
+) -> str:
+    """Render the events for a prompt, cached by their content."""
+    return _render_events(events.model_dump_json(), options.model_dump_json())
+
+
+def render_tasks(tasks: TasksList, options: RenderOptions = RenderOptions()) -> str:
+    """Render the tasks for a prompt, cached by their content."""
+    return _render_tasks(tasks.model_dump_json(), options.model_dump_json())
+
+
+@lru_cache(maxsize=128)
+def _render_events(events_json: str, options_json: str) -> str:
+    events = CalendarEventList.model_validate_json(events_json)
+    options = RenderOptions.model_validate_json(options_json)
+    if not options.compact:
+        return str(events)
+
+    return COMPACT_SEPARATOR.join(
+        "Calendar: {calendar}\n{calendar_values}".format(
+            calendar=list(calendar.keys())[0],
+            calendar_values="\n".join(
+                _compact_event(event) for event in list(calendar.values())[0]
+            ),
+        )
+        for calendar in events.events
+    )
+
+
+def _compact_event(event: CalendarEvent) -> str:
+    # All-day events only have a date
+    if "T" not in event.start:
+        return f"All day: {event.summary}"
+
+    start = getDateTimeFromISO8601String(event.start)
+    end = getDateTimeFromISO8601String(event.end)
+    if start.date() == end.date():
+        return f"{start:%H:%M}-{end:%H:%M}: {event.summary}"
+    return f"{start:%Y-%m-%d %H:%M}-{end:%Y-%m-%d %H:%M}: {event.summary}"
+
+
+def _compact_task(task: TaskModel, notes: str) -> str:
+    details = []
+    if task.due_date != "No due date":
+        details.append(f"due {getDateTimeFromISO8601String(task.due_date):%Y-%m-%d}")
+    if task.duration:
+        details.append(task.duration)
+
+    return (
+        f" - {task.title}"
+        + (f" ({', '.join(details)})" if details else "")
+        + (f": {notes}" if notes else "")
+    )
+
+
+def _truncate(text: str, max_tokens: int | None) -> str:
+    if max_tokens is None or estimate_tokens(text) <= max_tokens:
+        return text
+    return text[: max(max_tokens * CHARS_PER_TOKEN - 3, 0)].rstrip() + "..."
+
+
+@lru_cache(maxsize=128)
+def _render_tasks(tasks_json: str, options_json: str) -> str:
+    tasks = TasksList.model_validate_json(tasks_json)
+    options = RenderOptions.model_validate_json(options_json)
+
+    notes_tokens = options.max_note_tokens
+    rendered = _render_task_lists(tasks, options, notes_tokens)
+    if options.token_budget is None:
+        return rendered
+
+    # Shorten the notes until the tasks fit in the budget, then drop them
+    longest_note = max(
+        (
+            estimate_tokens(task.notes)
+            for task_list in tasks.tasks
+            for task in list(task_list.values())[0]
+        ),
+        default=0,
+    )
+    notes_tokens = min(notes_tokens or longest_note, longest_note)
+    while estimate_tokens(rendered) > options.token_budget and notes_tokens > 0:
+        notes_tokens //= 2
+        rendered = _render_task_lists(tasks, options, notes_tokens)
+
+    # Still too long: keep as many tasks as fit in the budget. The rendered text
+    # grows with the tasks shown, so the number is found with a binary search
+    max_tasks = options.max_tasks_per_list or max(
+        (len(list(task_list.values())[0]) for task_list in tasks.tasks), default=0
+    )
+    if estimate_tokens(rendered) <= options.token_budget or max_tasks <= 1:
+        return rendered
+
+    def render_first(max_tasks: int) -> str:
+        return _render_task_lists(
+            tasks, options.model_copy(update={"max_tasks_per_list": max_tasks}), 0
+        )
+
+    fitting, low, high = None, 1, max_tasks - 1
+    while low <= high:
+        middle = (low + high) // 2
+        candidate = render_first(middle)
+        if estimate_tokens(candidate) <= options.token_budget:
+            fitting, low = candidate, middle + 1
+        else:
+            high = middle - 1
+    # Not even one task per list fits, show one anyway
+    return fitting if fitting is not None else render_first(1)
+
+
+def _render_task_lists(
+    tasks: TasksList, options: RenderOptions, notes_tokens: int | None
+) -> str:
+    task_str = []
+    for task_list in tasks.tasks:
+        title = list(task_list.keys())[0]
+        task_values = list(task_list.values())[0]
+        shown = task_values[: options.max_tasks_per_list]
+
+        lines = []
+        for task in shown:
+            notes = "" if notes_tokens == 0 else _truncate(task.notes, notes_tokens)
+            if options.compact:
+                lines.append(_compact_task(task, notes))
+            else:
+                lines.append(" - " + str(task.model_copy(update={"notes": notes})))
+        if len(shown) < len(task_values):
+            lines.append(f" - ... and {len(task_values) - len(shown)} more tasks")
+
+        task_str.append(f"Task List: {title}\n" + "\n".join(lines))
+
+    separator = COMPACT_SEPARATOR if options.compact else SEPARATOR
+    return separator.join(task_str)
@@ -75,3 +75,39 @@ Please make the necessary changes to the schedule based on the feedback provided
 Please ensure that the changes are logical and maintain the overall structure of the schedule.
 Remember that the given events must remain in the same place in the schedule and that they should not be changed.
 """
+
+DRAFT_PROMPT = """
+This is a draft of the schedule in which the tasks have already been placed in the free time around the events, without overlapping them:
+
+{draft}
+
+Use this draft as the starting point of the schedule. You can move, shorten or remove tasks if it makes the day more logical, but keep the events in their place and do not put two tasks at the same time.
+"""
+
+PRE_REVIEW_FEEDBACK = """
+The schedule has the following problems, found by checking it against the events:
+
+{violations}
+
+CHANGES
+"""
+
+PLANNING_WINDOW_PROMPT = """
+Plan the {days} days from {first_day} to {last_day}, not only today. The events of each day are listed under its date.
+Spread the tasks over the days taking into account their due dates, and write the date in every line of the schedule, e.g. **{first_day} 10:00 - {first_day} 11:00**: Task.
+"""
+
+PLANNING_WINDOW_REVIEW = """
+The schedule covers the {days} days from {first_day} to {last_day}, the events of each day are listed under its date.
+"""
+
+# Extra instructions of the speculative candidate schedules, one per candidate
+CANDIDATE_PROMPTS = [
+    "Place the tasks with the nearest due date first and as early as possible.",
+    "Group similar tasks together and leave short breaks between long blocks of work.",
+    "Keep the schedule light: give each task a realistic time and leave free time at the end of the day.",
+]
+
+STRUCTURED_PLAN_PROMPT = """
+Give the schedule by calling the Schedule tool. Add one entry for each event and task, with its summary and its start and end in ISO 8601 format with the UTC offset, e.g. {current_time}. Mark the existing events as fixed.
+"""
@@ -0,0 +1,15 @@
+from .engine import (
+    BusyIndex,
+    build_draft_schedule,
+    parse_duration,
+    planning_dates,
+    split_events_by_day,
+)
+from .validator import (
+    ScheduleSlot,
+    parse_schedule,
+    schedule_slots,
+    check_schedule,
+    validate_schedule,
+)
+from .scoring import ScheduleScore, score_schedule
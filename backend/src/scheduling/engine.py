@@ -0,0 +1,246 @@
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta
+import re
+
+from src.models import (
+    CalendarEventList,
+    TasksList,
+    TaskModel,
+    Schedule,
+    ScheduleEntry,
+)
+from src.utils import getDateTimeFromISO8601String, local_datetime
+
+DAY_START = time(8, 0)
+DAY_END = time(22, 0)
+DEFAULT_TASK_DURATION = timedelta(minutes=30)
+# Tasks start at multiples of this number of minutes
+SLOT_GRANULARITY = 5
+
+DURATION_REGEX = re.compile(
+    r"(\d+(?:[.,]\d+)?)\s*(h|hours?|horas?|m|mins?|minutes?|minutos?)\b", re.IGNORECASE
+)
+
+
+class BusyIndex:
+    """Sorted list of non-overlapping busy intervals.
+
+    Overlapping or touching intervals are merged when added, so free time can
+    be found with a binary search.
+    """
+
+    def __init__(self, intervals: list[tuple[datetime, datetime]] = ()) -> None:
+        self._starts: list[datetime] = []
+        self._ends: list[datetime] = []
+        for start, end in sorted(intervals):
+            self.add(start, end)
+
+    def add(self, start: datetime, end: datetime) -> None:
+        """Mark an interval as busy."""
+        if end <= start:
+            return
+        # First interval that could touch the new one
+        i = bisect_right(self._ends, start)
+        if i > 0 and self._ends[i - 1] >= start:
+            i -= 1
+        j = i
+        while j < len(self._starts) and self._starts[j] <= end:
+            start = min(start, self._starts[j])
+            end = max(end, self._ends[j])
+            j += 1
+        self._starts[i:j] = [start]
+        self._ends[i:j] = [end]
+
+    def is_free(self, start: datetime, end: datetime) -> bool:
+        i = bisect_right(self._ends, start)
+        return i == len(self._starts) or self._starts[i] >= end
+
+    def free_slots(
+        self, start: datetime, end: datetime
+    ) -> list[tuple[datetime, datetime]]:
+        """Get the free intervals between start and end."""
+        slots = []
+        cursor = start
+        i = bisect_right(self._ends, start)
+        while cursor < end:
+            if i < len(self._starts) and self._starts[i] < end:
+                if self._starts[i] > cursor:
+                    slots.append((cursor, self._starts[i]))
+                cursor = max(cursor, self._ends[i])
+                i += 1
+            else:
+                slots.append((cursor, end))
+                break
+        return slots
+
+    def first_fit(
+        self, duration: timedelta, start: datetime, end: datetime
+    ) -> tuple[datetime, datetime] | None:
+        """Find the earliest free interval of the given duration between start and end."""
+        for slot_start, slot_end in self.free_slots(start, end):
+            if slot_end - slot_start >= duration:
+                return slot_start, slot_start + duration
+        return None
+
+
+def parse_duration(
+    duration: str, default: timedelta = DEFAULT_TASK_DURATION
+) -> timedelta:
+    """Parse a task duration such as "12.5 minutes" or "1 hour 30 min".
+
+    Durations are rounded up to the slot granularity, and the default is used
+    when nothing can be parsed.
+    """
+    total = timedelta()
+    for amount, unit in DURATION_REGEX.findall(duration or ""):
+        amount = float(amount.replace(",", "."))
+        if unit.lower().startswith("h"):
+            total += timedelta(hours=amount)
+        else:
+            total += timedelta(minutes=amount)
+
+    if total <= timedelta():
+        return default
+    return _round_up(total)
+
+
+def _round_up(delta: timedelta) -> timedelta:
+    granularity = SLOT_GRANULARITY * 60
+    seconds = -(-int(delta.total_seconds()) // granularity) * granularity
+    return timedelta(seconds=seconds)
+
+
+def _ceil_time(date: datetime) -> datetime:
+    """Round a datetime up to the slot granularity."""
+    date = date.replace(second=0, microsecond=0) + (
+        timedelta(minutes=1) if date.second or date.microsecond else timedelta()
+    )
+    return date + timedelta(minutes=-date.minute % SLOT_GRANULARITY)
+
+
+def _due_key(task: TaskModel) -> datetime:
+    if task.due_date == "No due date":
+        return datetime.max
+    return getDateTimeFromISO8601String(task.due_date).replace(tzinfo=None)
+
+
+def planning_dates(current_time: str, days: int = 1) -> list[date]:
+    """Get the dates of a planning window that starts on the day of current_time."""
+    first_day = getDateTimeFromISO8601String(current_time).date()
+    return [first_day + timedelta(days=i) for i in range(days)]
+
+
+def _event_dates(start: str, end: str) -> tuple[date, date]:
+    """Get the first and last dates in which an event takes place."""
+    start_date = getDateTimeFromISO8601String(start)
+    end_date = getDateTimeFromISO8601String(end)
+    if "T" not in start:
+        # The end of all-day events is the day after their last day
+        return start_date.date(), end_date.date() - timedelta(days=1)
+    # Events that end at midnight do not take place on the next day
+    return start_date.date(), (end_date - timedelta(microseconds=1)).date()
+
+
+def split_events_by_day(
+    events: CalendarEventList, dates: list[date]
+) -> dict[date, CalendarEventList]:
+    """Bucket the events of a multi-day window into the days they take place.
+
+    Events that last several days are in all of them. Every calendar is kept in
+    every day, so a day can also show that a calendar has no events.
+
+    Args:
+        events (CalendarEventList): Events of the whole window.
+        dates (list[date]): Days of the window.
+    """
+    days = {day: [] for day in dates}
+    for calendar in events.events:
+        summary, calendar_events = list(calendar.items())[0]
+        by_day = {day: [] for day in dates}
+        for event in calendar_events:
+            first, last = _event_dates(event.start, event.end)
+            for day in dates:
+                if first <= day <= last:
+                    by_day[day].append(event)
+        for day in dates:
+            days[day].append({summary: by_day[day]})
+    return {day: CalendarEventList(events=days[day]) for day in dates}
+
+
+def build_draft_schedule(
+    events: CalendarEventList,
+    tasks: TasksList,
+    current_time: str,
+    day_start: time = DAY_START,
+    day_end: time = DAY_END,
+    default_duration: timedelta = DEFAULT_TASK_DURATION,
+    days: int = 1,
+) -> Schedule:
+    """Place the tasks in the free time around the fixed events of the window.
+
+    The timed events keep their place and all-day events are ignored. The tasks
+    are placed in order of due date, each one in the earliest free slot after
+    the current time that fits its duration. Tasks that do not fit are listed
+    as unscheduled.
+
+    Args:
+        events (CalendarEventList): Events of the planning window.
+        tasks (TasksList): Tasks to place.
+        current_time (str): Current time in ISO format.
+        day_start (time): Time at which the day starts.
+        day_end (time): Time at which the day ends.
+        default_duration (timedelta): Duration of the tasks without a known duration.
+        days (int): Number of days of the window, starting today.
+
+    Returns:
+        Schedule: Conflict-free draft schedule.
+    """
+    now = getDateTimeFromISO8601String(current_time)
+    # Free time of each day of the window, today starts now
+    windows = [
+        (local_datetime(day, day_start), local_datetime(day, day_end))
+        for day in planning_dates(current_time, days)
+    ]
+    windows[0] = (max(_ceil_time(now), windows[0][0]), windows[0][1])
+
+    entries = []
+    busy = BusyIndex()
+    for calendar in events.events:
+        for event in list(calendar.values())[0]:
+            # All-day events only have a date
+            if "T" not in event.start:
+                continue
+            start = getDateTimeFromISO8601String(event.start)
+            end = getDateTimeFromISO8601String(event.end)
+            busy.add(start, end)
+            entry = ScheduleEntry(
+                summary=event.summary, start=event.start, end=event.end, fixed=True
+            )
+            entries.append((start, entry))
+
+    pending = [
+        task for task_list in tasks.tasks for task in list(task_list.values())[0]
+    ]
+    # sorted is stable, tasks with the same due date keep their order
+    pending = sorted(pending, key=_due_key)
+
+    unscheduled = []
+    for task in pending:
+        duration = parse_duration(task.duration, default_duration)
+        slot = None
+        for window_start, window_end in windows:
+            slot = busy.first_fit(duration, window_start, window_end)
+            if slot is not None:
+                break
+        if slot is None:
+            unscheduled.append(task.title)
+            continue
+        start, end = slot
+        busy.add(start, end)
+        entry = ScheduleEntry(
+            summary=task.title, start=start.isoformat(), end=end.isoformat()
+        )
+        entries.append((start, entry))
+
+    entries.sort(key=lambda entry: entry[0])
+    return Schedule(entries=[entry for _, entry in entries], unscheduled=unscheduled)
@@ -0,0 +1,89 @@
+from pydantic import BaseModel, Field
+
+from src.models import CalendarEventList, TasksList, Schedule
+from src.scheduling.validator import check_schedule, read_slots, _matches
+from src.utils import getDateTimeFromISO8601String
+
+# Points of each part of the score, every violation subtracts its weight
+WEIGHTS = {
+    "coverage": 10.0,  # All the tasks are in the schedule
+    "events": 5.0,  # A fixed event is missing or moved
+    "overlaps": 3.0,  # Two slots overlap
+    "window": 3.0,  # A slot is outside the planning window
+    "late": 1.0,  # A task is placed after its due date
+}
+
+
+class ScheduleScore(BaseModel):
+    parsed: bool = Field(..., description="Whether the schedule has time slots")
+    coverage: float = Field(0.0, description="Fraction of the tasks in the schedule")
+    events: int = Field(0, description="Fixed events missing or moved")
+    overlaps: int = Field(0, description="Overlapping slots")
+    window: int = Field(0, description="Slots outside the planning window")
+    late: int = Field(0, description="Tasks placed after their due date")
+
+    @property
+    def total(self) -> float:
+        """Weighted score, higher is better. Unparsable schedules score -inf."""
+        if not self.parsed:
+            return float("-inf")
+        return WEIGHTS["coverage"] * self.coverage - sum(
+            WEIGHTS[kind] * getattr(self, kind)
+            for kind in ("events", "overlaps", "window", "late")
+        )
+
+    def __str__(self) -> str:
+        if not self.parsed:
+            return "unparsable"
+        return (
+            f"{self.total:.2f} (coverage {self.coverage:.0%}, {self.events} event "
+            f"errors, {self.overlaps} overlaps, {self.window} outside the window, "
+            f"{self.late} late tasks)"
+        )
+
+
+def score_schedule(
+    schedule: str | Schedule,
+    events: CalendarEventList,
+    tasks: TasksList,
+    current_time: str,
+    days: int = 1,
+) -> ScheduleScore:
+    """Score a free-text or structured schedule without an LLM.
+
+    The score rewards the tasks that appear in the schedule and penalizes the
+    violations of the validator (fixed events missing or moved, overlaps and
+    slots outside the window) and the tasks placed after their due date.
+    """
+    try:
+        slots = read_slots(schedule, current_time)
+    except ValueError:
+        slots = []
+    if not slots:
+        return ScheduleScore(parsed=False)
+
+    violations = check_schedule(slots, events, current_time, days)
+
+    all_tasks = [
+        task for task_list in tasks.tasks for task in list(task_list.values())[0]
+    ]
+    placed, late = 0, 0
+    for task in all_tasks:
+        task_slots = [slot for slot in slots if _matches(task.title, slot)]
+        if not task_slots:
+            continue
+        placed += 1
+        if task.due_date != "No due date":
+            # Due dates of Google Tasks are dates, the time is always midnight
+            due = getDateTimeFromISO8601String(task.due_date).date()
+            if task_slots[0].start.date() > due:
+                late += 1
+
+    return ScheduleScore(
+        parsed=True,
+        coverage=placed / len(all_tasks) if all_tasks else 1.0,
+        events=len(violations["events"]),
+        overlaps=len(violations["overlaps"]),
+        window=len(violations["window"]),
+        late=late,
+    )
@@ -0,0 +1,215 @@
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+import re
+
+from pydantic import BaseModel, Field
+
+from src.models import CalendarEventList, Schedule
+from src.utils import getDateTimeFromISO8601String, local_datetime
+from src.utils.time_utils import timezone
+
+# Hours and minutes, with optional seconds, UTC offset (ISO 8601) and AM/PM
+_TIME = (
+    r"(?<![\d:])(\d{1,2})[:.h](\d{2})(?::(\d{2})(?:\.\d+)?)?"
+    r"(Z|[+-]\d{2}:?\d{2})?\s*([AaPp]\.?[Mm]\.?)?"
+)
+_DATE = r"(\d{4}-\d{2}-\d{2})"
+SLOT_REGEX = re.compile(
+    rf"(?:{_DATE}[ T])?{_TIME}\s*(?:-|–|—|to|a)\s*(?:{_DATE}[ T])?{_TIME}"
+)
+# Times left in a line after taking its slot, the line is ambiguous
+STRAY_TIME_REGEX = re.compile(r"\d{1,2}:\d{2}")
+# Characters of markdown and list formatting around the summary of a slot
+SUMMARY_STRIP = " *_:|-–—•#\t"
+
+
+class ScheduleSlot(BaseModel):
+    summary: str = Field(..., description="Line of the schedule without the times")
+    start: datetime = Field(..., description="Start of the slot")
+    end: datetime = Field(..., description="End of the slot")
+
+    def __str__(self) -> str:
+        return f"'{self.summary}' ({self.start:%H:%M}-{self.end:%H:%M})"
+
+
+def _to_datetime(
+    date: str | None,
+    hour: str,
+    minute: str,
+    second: str | None,
+    offset: str | None,
+    meridiem: str | None,
+    default: datetime,
+) -> datetime:
+    hour, minute, second = int(hour), int(minute), int(second or 0)
+    if meridiem:
+        meridiem = meridiem.lower().replace(".", "")
+        hour = hour % 12 + (12 if meridiem == "pm" else 0)
+    day = datetime.strptime(date, "%Y-%m-%d").date() if date else default.date()
+    if hour == 24 and minute == 0:
+        # Midnight at the end of the day
+        day, hour = day + timedelta(days=1), 0
+    if offset:
+        # Explicit offsets (e.g. ISO 8601 times) are converted to local time
+        if offset == "Z":
+            tzinfo = dt_timezone.utc
+        else:
+            sign = -1 if offset[0] == "-" else 1
+            hours, minutes = int(offset[1:3]), int(offset[-2:])
+            tzinfo = dt_timezone(sign * timedelta(hours=hours, minutes=minutes))
+        value = datetime.combine(day, time(hour, minute, second), tzinfo)
+        return value.astimezone(timezone)
+    # The offset of the day, which may differ from the one of default (DST)
+    return local_datetime(day, time(hour, minute, second))
+
+
+def parse_schedule(schedule: str, current_time: str) -> list[ScheduleSlot]:
+    """Get the time slots of a free-text schedule.
+
+    Every line with a time range (e.g. "**10:00 - 11:30**: Class") is a slot.
+    Lines without a date are taken to be on the day of current_time, and the
+    times are local times with the UTC offset of their day.
+
+    Raises:
+        ValueError: If a time range has invalid hours or minutes, or a line has
+            more times than its time range.
+    """
+    now = getDateTimeFromISO8601String(current_time)
+    slots = []
+    for line in schedule.splitlines():
+        match = SLOT_REGEX.search(line)
+        if match is None:
+            continue
+        start_date, *start, start_mer = match.groups()[:6]
+        end_date, *end, end_mer = match.groups()[6:]
+        start = _to_datetime(start_date, *start, start_mer or end_mer, now)
+        end = _to_datetime(end_date or start_date, *end, end_mer, now)
+
+        summary = (line[: match.start()] + " " + line[match.end() :]).strip(
+            SUMMARY_STRIP
+        )
+        if STRAY_TIME_REGEX.search(summary):
+            raise ValueError(f"Ambiguous time range in '{line}'")
+        slots.append(ScheduleSlot(summary=summary, start=start, end=end))
+    return slots
+
+
+def schedule_slots(schedule: Schedule) -> list[ScheduleSlot]:
+    """Get the time slots of a structured schedule, in the timezone of the calendar."""
+    return [
+        ScheduleSlot(
+            summary=entry.summary,
+            start=getDateTimeFromISO8601String(entry.start).astimezone(timezone),
+            end=getDateTimeFromISO8601String(entry.end).astimezone(timezone),
+        )
+        for entry in schedule.entries
+    ]
+
+
+def read_slots(schedule: str | Schedule, current_time: str) -> list[ScheduleSlot]:
+    """Get the time slots of a structured or free-text schedule.
+
+    Raises:
+        ValueError: If a free-text schedule cannot be parsed.
+    """
+    if isinstance(schedule, Schedule):
+        return schedule_slots(schedule)
+    return parse_schedule(schedule, current_time)
+
+
+def _matches(summary: str, slot: ScheduleSlot) -> bool:
+    summary, slot_summary = summary.lower().strip(), slot.summary.lower()
+    return bool(summary) and (summary in slot_summary or slot_summary in summary)
+
+
+def check_schedule(
+    slots: list[ScheduleSlot],
+    events: CalendarEventList,
+    current_time: str,
+    days: int = 1,
+) -> dict[str, list[str]]:
+    """Check the slots of a schedule against the fixed events of the window.
+
+    Returns:
+        dict: The violations found by kind: "window" (slots that end before
+            they start or are outside the window), "events" (fixed events that
+            are missing or moved) and "overlaps".
+    """
+    now = getDateTimeFromISO8601String(current_time)
+    day_start = local_datetime(now.date(), time.min)
+    day_end = local_datetime(now.date() + timedelta(days=days), time.min)
+    if days == 1:
+        window = f"the day {now.date()}"
+    else:
+        window = f"the days {now.date()} to {(day_end - timedelta(days=1)).date()}"
+
+    violations = {"window": [], "events": [], "overlaps": []}
+    for slot in slots:
+        if slot.end <= slot.start:
+            violations["window"].append(f"{slot} ends before it starts.")
+        elif slot.start < day_start or slot.end > day_end:
+            violations["window"].append(f"{slot} is not inside {window}.")
+
+    fixed = set()
+    for calendar in events.events:
+        for event in list(calendar.values())[0]:
+            # All-day events do not take a slot in the schedule
+            if "T" not in event.start:
+                continue
+            start = getDateTimeFromISO8601String(event.start).astimezone(timezone)
+            end = getDateTimeFromISO8601String(event.end).astimezone(timezone)
+            candidates = [slot for slot in slots if _matches(event.summary, slot)]
+            exact = [
+                slot for slot in candidates if (slot.start, slot.end) == (start, end)
+            ]
+            if exact:
+                fixed.update(id(slot) for slot in exact)
+            elif candidates:
+                violations["events"].append(
+                    f"The event '{event.summary}' must be at "
+                    f"{start:%H:%M}-{end:%H:%M}, but it is at "
+                    f"{candidates[0].start:%H:%M}-{candidates[0].end:%H:%M}."
+                )
+            else:
+                violations["events"].append(
+                    f"The event '{event.summary}' ({start:%H:%M}-{end:%H:%M}) "
+                    "is missing from the schedule."
+                )
+
+    ordered = sorted(
+        (slot for slot in slots if slot.end > slot.start), key=lambda s: s.start
+    )
+    for i, slot in enumerate(ordered):
+        for other in ordered[i + 1 :]:
+            if other.start >= slot.end:
+                break
+            # Events that overlap in the calendar are not a mistake of the schedule
+            if id(slot) in fixed and id(other) in fixed:
+                continue
+            violations["overlaps"].append(f"{slot} overlaps with {other}.")
+
+    return violations
+
+
+def validate_schedule(
+    schedule: str | Schedule, events: CalendarEventList, current_time: str, days: int = 1
+) -> list[str] | None:
+    """Check a schedule against the fixed events of the window without an LLM.
+
+    The checks are: every timed event appears with its original time, no two
+    slots overlap (except an event with itself), every slot ends after it
+    starts and is inside the planning window of the given number of days.
+    Structured schedules are checked as they are, without parsing their text.
+
+    Returns:
+        list[str] | None: The violations found, empty if the schedule is valid.
+            None when the schedule cannot be parsed and needs a human or LLM review.
+    """
+    try:
+        slots = read_slots(schedule, current_time)
+    except ValueError:
+        return None
+    if not slots:
+        return None
+
+    violations = check_schedule(slots, events, current_time, days)
+    return violations["window"] + violations["events"] + violations["overlaps"]
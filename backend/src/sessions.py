@@ -0,0 +1,78 @@
+"""Session tokens that bind the requests of the server to a user.
+
+A token holds the user id and its expiry, signed with the SESSION_SECRET of
+the environment, so the server checks it without storing the sessions.
+
+Usage, from the backend directory:
+    python -m src.sessions alice --days 30
+"""
+
+from datetime import datetime, timedelta, timezone
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+
+from src.tools.google_services import USER_ID_REGEX
+
+SESSION_SECRET_ENV = "SESSION_SECRET"
+# Days a session token is valid by default
+SESSION_DAYS = 30
+
+
+def _secret(secret: str | None) -> bytes:
+    secret = secret or os.getenv(SESSION_SECRET_ENV)
+    if not secret:
+        raise RuntimeError(
+            f"{SESSION_SECRET_ENV} is not set, the sessions of the users are disabled"
+        )
+    return secret.encode()
+
+
+def _signature(payload: str, secret: bytes) -> str:
+    digest = hmac.new(secret, payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+
+def create_session_token(
+    user_id: str, days: int = SESSION_DAYS, secret: str | None = None
+) -> str:
+    """Create the session token of a user.
+
+    Args:
+        user_id (str): Id of the user.
+        days (int): Days until the token expires.
+        secret (str): Key of the signature. Defaults to 'SESSION_SECRET' found
+            in the environment variables.
+    """
+    if not USER_ID_REGEX.fullmatch(user_id):
+        raise ValueError(f"Invalid user id '{user_id}'")
+    expires = int((datetime.now(timezone.utc) + timedelta(days=days)).timestamp())
+    payload = f"{user_id}.{expires}"
+    return f"{payload}.{_signature(payload, _secret(secret))}"
+
+
+def read_session_token(token: str, secret: str | None = None) -> str:
+    """Get the user id of a session token.
+
+    Raises:
+        ValueError: If the token is malformed, expired or not signed with the secret.
+        RuntimeError: If there is no secret, the sessions are disabled.
+    """
+    key = _secret(secret)
+    payload, _, signature = token.rpartition(".")
+    user_id, _, expires = payload.rpartition(".")
+    if not hmac.compare_digest(signature, _signature(payload, key)):
+        raise ValueError("Invalid session token")
+    if not expires.isdigit() or int(expires) < datetime.now(timezone.utc).timestamp():
+        raise ValueError("The session token expired")
+    return user_id
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the session token of a user")
+    parser.add_argument("user_id")
+    parser.add_argument("--days", type=int, default=SESSION_DAYS)
+    args = parser.parse_args()
+    print(create_session_token(args.user_id, args.days))
@@ -0,0 +1,75 @@
+from typing import Any, AsyncIterator
+import json
+import uuid
+
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from pydantic import BaseModel
+
+from src import metrics
+from src.tools import use_plan_run
+
+
+def to_jsonable(value: Any) -> Any:
+    """Convert a graph state update into JSON serializable values."""
+    if isinstance(value, BaseMessage):
+        return {
+            "type": value.type,
+            "content": value.content,
+            "tool_calls": getattr(value, "tool_calls", []),
+        }
+    if isinstance(value, BaseModel):
+        return {"text": str(value), "data": value.model_dump(mode="json")}
+    if isinstance(value, dict):
+        return {str(k): to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def format_sse(event: str, data: Any) -> str:
+    """Format a server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_schedule(
+    graph, inputs: dict[str, Any], config: dict[str, Any]
+) -> AsyncIterator[str]:
+    """Run the schedule graph and stream its progress as server-sent events.
+
+    Events:
+        node: the state update of a node when it finishes (events, tasks,
+            draft, schedule, feedback...).
+        token: a token generated by an LLM, with the node generating it.
+        error: the run failed.
+        end: the run finished, with the summary of its metrics.
+    """
+    try:
+        # The events planned by the run are tagged with its id
+        run_id = config.get("configurable", {}).get("thread_id") or str(uuid.uuid4())
+        with metrics.track_run() as run, use_plan_run(run_id):
+            async for mode, chunk in graph.astream(
+                inputs, config=config, stream_mode=["updates", "messages"]
+            ):
+                if mode == "messages":
+                    message, metadata = chunk
+                    # Only tokens streamed by the models, not messages added to the state
+                    if isinstance(message, AIMessageChunk) and message.content:
+                        yield format_sse(
+                            "token",
+                            {
+                                "node": metadata.get("langgraph_node"),
+                                "content": message.content,
+                            },
+                        )
+                else:
+                    for node, update in chunk.items():
+                        yield format_sse(
+                            "node", {"node": node, "update": to_jsonable(update)}
+                        )
+    except Exception as e:
+        yield format_sse("error", {"message": str(e)})
+        return
+
+    yield format_sse("end", {"metrics": run.as_dict()})
@@ -4,7 +4,19 @@ from .calendar_tools import (
     get_calendar_events,
     list_tasks,
     get_tasks,
-    create_calendar_events
+    create_calendar_events,
+    upsert_planned_events,
+    list_planned_events,
+    use_plan_run,
 )
 from .time_tools import get_current_time, get_date_in_iso_format, sum_to_date
-from .search_tools import get_webpage_text, get_time_read
\ No newline at end of file
+from .search_tools import get_webpage_text, get_time_read, estimate_reading_time
+from .tool_utils import parallel_safe, is_parallel_safe
+from .google_services import (
+    GoogleServices,
+    GoogleServicesCache,
+    get_services,
+    use_services,
+    get_calendar_id,
+    use_calendar,
+)
@@ -1,66 +1,61 @@
-from datetime import datetime
-from typing import List, Dict, Any
-import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from typing import List, Dict, Any, Callable, Iterator
+import threading
+import weakref
 import pytz
-import os
 
 # Models
 from src.models import CalendarModel, CalendarEvent, TaskListModel, TaskModel
+from src.cache import SyncCache
+from src.utils import getDateTimeFromISO8601String
+from src import metrics
 
 # Agents and tools
 from langchain.tools import tool
+from src.tools.tool_utils import parallel_safe
 
 # from smolagents import tool
 
-# Google API client libraries
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from google.auth.exceptions import RefreshError
-from googleapiclient.discovery import build
+# Google API service clients, authenticated on first use
+from src.tools.google_services import (
+    get_calendar_service,
+    get_tasks_service,
+    get_calendar_id,
+    get_services,
+)
+from googleapiclient.errors import HttpError
 
 timezone = pytz.timezone("Europe/Madrid")
-# Scopes for API access
-SCOPES = [
-    "https://www.googleapis.com/auth/calendar",
-    "https://www.googleapis.com/auth/tasks",
-]
-TOKEN_FILE = "token.json"
-CREDENTIALS_FILE = "credentials.json"
-
-creds = None
-
-# Check for existing token
-if os.path.exists(TOKEN_FILE):
-    creds = Credentials.from_authorized_user_info(
-        json.loads(open(TOKEN_FILE).read()), SCOPES
-    )
-
-# If there are no valid credentials, authenticate
-if not creds or not creds.valid:
-    try:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-            creds = flow.run_local_server(port=0)
-    except RefreshError as e:
-        print(f"An error occurred during authentication: {e}")
-        flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-        creds = flow.run_local_server(port=0)
-        # creds = flow.run_console()
-
-    # Save credentials for next run
-    with open(TOKEN_FILE, "w") as token:
-        token.write(creds.to_json())
-
-print("Authentication successful!")
-
-# Build service clients
-calendar_service = build("calendar", "v3", credentials=creds)
-tasks_service = build("tasks", "v1", credentials=creds)
-
-
+# Maximum number of requests sent in a single batch HTTP request
+MAX_BATCH_SIZE = 50
+# Largest page of each list request of the Google APIs
+MAX_CALENDARS_PAGE_SIZE = 250
+MAX_EVENTS_PAGE_SIZE = 2500
+MAX_TASK_LISTS_PAGE_SIZE = 1000
+MAX_TASKS_PAGE_SIZE = 100
+# Partial responses, only the fields that are used are sent. The page and sync
+# tokens must be included for the pagination and the incremental syncs.
+CALENDAR_FIELDS = "nextPageToken,items(id,summary)"
+EVENT_FIELDS = (
+    "nextPageToken,nextSyncToken,"
+    "items(id,status,summary,start,end,extendedProperties)"
+)
+TASK_LIST_FIELDS = "nextPageToken,items(id,title)"
+TASK_FIELDS = "nextPageToken,items(id,title,notes,due,status,deleted,hidden,position)"
+# Private extended properties of the events created by the scheduler
+PLANNED_PROPERTY = "aiSchedulerPlanned"
+RUN_PROPERTY = "aiSchedulerRun"
+# Id of the run planning the events of the current context, if any
+_current_plan_run: ContextVar[str | None] = ContextVar("plan_run", default=None)
+# Lock of each calendar of each user's services, held while its planned events
+# are listed, compared and changed
+_calendar_locks: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_calendar_locks_guard = threading.Lock()
+
+
+@parallel_safe
 @tool
 def create_calendar_events(calendar_events: list[dict[str, str]]):
     """Creates all new calendar events at once given in a list with the summary, start_time and end_time
@@ -73,14 +68,10 @@ def create_calendar_events(calendar_events: list[dict[str, str]]):
                 end_time (str): End time in ISO format.
     """
     print("Creating events...")
-    created_events = []
-    for event in calendar_events:
-        created_event = create_calendar_event.invoke(event)
-        created_events.append(created_event)
-
-    return created_events
+    return upsert_planned_events(calendar_events)
 
 
+@parallel_safe
 @tool
 def create_calendar_event(
     summary: str, start_time: str, end_time: str
@@ -93,115 +84,493 @@ def create_calendar_event(
         end_time (str): End time in ISO format.
     """
     print(f"Creating new event '{summary}'...")
+    return upsert_planned_events(
+        [{"summary": summary, "start_time": start_time, "end_time": end_time}]
+    )[0]
+
+
+@contextmanager
+def use_plan_run(run_id: str) -> Iterator[str]:
+    """Tag the events planned inside the block with the given run id."""
+    token = _current_plan_run.set(run_id)
+    try:
+        yield run_id
+    finally:
+        _current_plan_run.reset(token)
+
+
+def upsert_planned_events(
+    calendar_events: List[Dict[str, str]],
+    time_min: str | None = None,
+    time_max: str | None = None,
+    delete: bool = False,
+    planned: List[Dict[str, Any]] | None = None,
+) -> List[Dict[str, Any]]:
+    """Make the planned events of the calendar match the given ones.
+
+    The events created by the scheduler are tagged with a private extended
+    property. The tagged events of the window are listed in a single request and
+    only the differences are sent, in batches: new events are inserted, events
+    with the same summary at another time are moved and, with delete, the
+    planned events that are no longer in the schedule are deleted. Planning the
+    same schedule again sends no changes.
+
+    Args:
+        calendar_events (list): Events with the summary, start_time and end_time.
+        time_min (str): Start of the window in ISO format. Defaults to the start
+            of the first event.
+        time_max (str): End of the window in ISO format. Defaults to the end of
+            the last event.
+        delete (bool): Delete the planned events of the window that are not in
+            calendar_events.
+        planned (list): Planned events of the window, when already listed with
+            list_planned_events.
+
+    Returns:
+        list: The event (or the error) of each of the calendar_events.
+    """
+    results = [None] * len(calendar_events)
+    desired = {}
+    for index, event in enumerate(calendar_events):
+        try:
+            desired[index] = (
+                event["summary"],
+                _local_time(event["start_time"]),
+                _local_time(event["end_time"]),
+            )
+        except KeyError as e:
+            results[index] = {
+                "summary": event.get("summary"),
+                "error": f"Missing attribute {e}",
+            }
+        except ValueError as e:
+            results[index] = {"summary": event.get("summary"), "error": str(e)}
+
+    if time_min is None or time_max is None:
+        if not desired:
+            return results
+        starts = [start for _, start, _ in desired.values()]
+        ends = [end for _, _, end in desired.values()]
+        time_min = time_min or min(starts).isoformat()
+        time_max = time_max or max(ends).isoformat()
+
+    calendar_id = get_calendar_id()
+    # Another call could move the same planned events between the list and the
+    # batch, e.g. the create calls of the same turn run at the same time
+    with _calendar_lock(calendar_id):
+        if planned is None:
+            planned = list_planned_events(time_min, time_max)
+        inserts, patches, deletes = _diff_planned_events(planned, desired, results)
+        if not delete:
+            deletes = []
+
+        events = get_calendar_service().events()
+        requests = [
+            (
+                index,
+                events.insert(
+                    calendarId=calendar_id,
+                    body=_build_event_body(
+                        calendar_events[index]["summary"],
+                        calendar_events[index]["start_time"],
+                        calendar_events[index]["end_time"],
+                    ),
+                ),
+            )
+            for index in inserts
+        ]
+        requests += [
+            (
+                index,
+                events.patch(
+                    calendarId=calendar_id,
+                    eventId=event_id,
+                    body=_build_event_body(
+                        calendar_events[index]["summary"],
+                        calendar_events[index]["start_time"],
+                        calendar_events[index]["end_time"],
+                    ),
+                ),
+            )
+            for index, event_id in patches
+        ]
+        requests += [
+            (None, events.delete(calendarId=calendar_id, eventId=event_id))
+            for event_id in deletes
+        ]
+
+        def callback(index, response, exception):
+            if index is None:
+                if exception is not None:
+                    print(f"Could not delete a planned event: {exception}")
+                return
+            summary = calendar_events[index].get("summary")
+            if exception is not None:
+                print(f"Could not create event '{summary}': {exception}")
+                results[index] = {"summary": summary, "error": str(exception)}
+            else:
+                print(f"Event planned: {response['htmlLink']}")
+                results[index] = response
+
+        _execute_batches(requests, callback)
+    print(
+        f"Planned events: {len(inserts)} inserted, {len(patches)} moved, "
+        f"{len(deletes)} deleted, "
+        f"{len(desired) - len(inserts) - len(patches)} unchanged"
+    )
+    return results
+
+
+def _calendar_lock(calendar_id: str | None) -> threading.Lock:
+    """Get the lock of a calendar of the services of the current user."""
+    with _calendar_locks_guard:
+        locks = _calendar_locks.setdefault(get_services(), {})
+        return locks.setdefault(calendar_id, threading.Lock())
+
+
+def _local_time(value: str) -> datetime:
+    """Parse an ISO time, times without UTC offset are local times of the calendar."""
+    parsed = getDateTimeFromISO8601String(value)
+    return parsed if parsed.tzinfo is not None else timezone.localize(parsed)
+
+
+def list_planned_events(time_min: str, time_max: str) -> List[Dict[str, Any]]:
+    """List the events created by the scheduler in the window, in a single request."""
+    planned, _ = _list_all_events(
+        get_calendar_id(),
+        timeMin=time_min,
+        timeMax=time_max,
+        privateExtendedProperty=f"{PLANNED_PROPERTY}=true",
+    )
+    return planned
+
+
+def _diff_planned_events(
+    planned: List[Dict[str, Any]],
+    desired: Dict[int, tuple[str, datetime, datetime]],
+    results: List[Dict[str, Any] | None],
+) -> tuple[List[int], List[tuple[int, str]], List[str]]:
+    """Compare the planned events of the calendar with the desired ones.
+
+    The desired events that are already planned get their event in results.
+
+    Returns:
+        tuple: The indexes of the desired events to insert, the indexes and event
+            ids of the ones to move and the ids of the planned events to delete.
+    """
+    # Planned events by summary, sorted by start so moves keep the order
+    by_summary = {}
+    for event in sorted(planned, key=lambda event: _event_time(event["start"])):
+        by_summary.setdefault(event.get("summary"), []).append(event)
+
+    pending = []
+    for index, (summary, start, end) in desired.items():
+        same_summary = by_summary.get(summary, [])
+        for event in same_summary:
+            if (_event_time(event["start"]), _event_time(event["end"])) == (start, end):
+                same_summary.remove(event)
+                results[index] = event
+                break
+        else:
+            pending.append(index)
+
+    inserts, patches = [], []
+    for index in pending:
+        same_summary = by_summary.get(desired[index][0])
+        if same_summary:
+            patches.append((index, same_summary.pop(0)["id"]))
+        else:
+            inserts.append(index)
+
+    deletes = [event["id"] for events in by_summary.values() for event in events]
+    return inserts, patches, deletes
+
+
+def _execute_batches(requests: List[tuple[Any, Any]], callback) -> None:
+    """Send the requests in batches of MAX_BATCH_SIZE.
 
-    # Create event body
-    event_body = {
+    Args:
+        requests (list): Pairs of the value passed to the callback and the request.
+        callback: Called with the value, the response and the exception of each
+            request.
+    """
+    calendar_service = get_calendar_service()
+    for batch_start in range(0, len(requests), MAX_BATCH_SIZE):
+        chunk = requests[batch_start : batch_start + MAX_BATCH_SIZE]
+        batch = calendar_service.new_batch_http_request(
+            callback=lambda request_id, response, exception: callback(
+                chunk[int(request_id)][0], response, exception
+            )
+        )
+        for i, (_, request) in enumerate(chunk):
+            batch.add(request, request_id=str(i))
+        with metrics.timer(
+            "scheduler_google_request_duration_seconds", method="batch"
+        ):
+            batch.execute()
+
+
+def _build_event_body(summary: str, start_time: str, end_time: str) -> Dict[str, Any]:
+    """Build the request body of a calendar event planned by the scheduler."""
+    private = {PLANNED_PROPERTY: "true"}
+    run_id = _current_plan_run.get()
+    if run_id is not None:
+        private[RUN_PROPERTY] = run_id
+    return {
         "summary": summary,
         "start": {"dateTime": start_time, "timeZone": str(timezone)},
         "end": {"dateTime": end_time, "timeZone": str(timezone)},
+        "extendedProperties": {"private": private},
     }
 
-    # Insert new event
-    created_event = (
-        calendar_service.events()
-        .insert(calendarId=os.getenv("CALENDAR_ID"), body=event_body)
-        .execute()
-    )
-
-    print(f"Event created: {created_event['htmlLink']}")
-    return created_event
-
 
 def list_calendars() -> List[Dict[str, Any]]:
     """List all calendars."""
-    calendars_result = calendar_service.calendarList().list().execute()
     calendars = [
         CalendarModel(id=calendar["id"], summary=calendar["summary"])
-        for calendar in calendars_result.get("items", [])
+        for calendar in _iter_items(
+            get_calendar_service().calendarList().list,
+            maxResults=MAX_CALENDARS_PAGE_SIZE,
+            fields=CALENDAR_FIELDS,
+        )
     ]
     return calendars
 
 
 def get_calendar_events(
-    id: str = os.getenv("CALENDAR_ID"), date: str = None
+    id: str = None, date: str = None, cache: SyncCache = None, days: int = 1
 ) -> List[CalendarEvent]:
     """Fetch calendar events for the specified date (today by default).
 
     Args:
         id (str): Calendar ID. Defaults to 'CALENDAR_ID' found in the environment variables.
         date (datetime): Date for which to fetch events. Defaults to today.
+        cache (SyncCache): Local cache, when given only the changes since the last
+            sync are requested.
+        days (int): Number of days to fetch starting at date, all of them are
+            listed in the same (paginated) request.
     """
+    if not id:
+        id = get_calendar_id()
     if not date:
         date = datetime.now(timezone)
 
-    # Set time boundaries for the day
-    start_time = date.replace(hour=0, minute=0, second=0).isoformat()
-    end_time = date.replace(hour=23, minute=59, second=59).isoformat()
-
-    events_result = (
-        calendar_service.events()
-        .list(
-            calendarId=id,
-            timeMin=start_time,
-            timeMax=end_time,
-            singleEvents=True,
-            orderBy="startTime",
-        )
-        .execute()
+    # Set time boundaries for the window
+    start_time = date.replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
+    last_day = datetime.combine(
+        (date + timedelta(days=days - 1)).date(), time(23, 59, 59)
     )
+    # pytz zones need localize to get the offset of the last day (DST changes)
+    localize = getattr(date.tzinfo, "localize", None)
+    last_day = localize(last_day) if localize else last_day.replace(tzinfo=date.tzinfo)
+    end_time = last_day.isoformat()
 
-    events = [
-        CalendarEvent(
-            id=event["id"],
-            summary=event.get("summary", "No summary"),
-            start=event["start"].get("dateTime", event["start"].get("date")),
-            end=event["end"].get("dateTime", event["end"].get("date")),
-        )
-        for event in events_result.get("items", [])
-    ]
+    if cache is not None:
+        return _sync_calendar_events(id, start_time, end_time, cache)
+
+    items, _ = _list_all_events(
+        id, timeMin=start_time, timeMax=end_time, orderBy="startTime"
+    )
+
+    events = [_to_calendar_event(event) for event in items]
 
     return events
 
 
+def _to_calendar_event(event: Dict[str, Any]) -> CalendarEvent:
+    return CalendarEvent(
+        id=event["id"],
+        summary=event.get("summary", "No summary"),
+        start=event["start"].get("dateTime", event["start"].get("date")),
+        end=event["end"].get("dateTime", event["end"].get("date")),
+    )
+
+
+def _event_time(time: Dict[str, str]) -> datetime:
+    """Get the datetime of the start or end of an event, all-day events use local midnight."""
+    if "dateTime" in time:
+        return getDateTimeFromISO8601String(time["dateTime"])
+    return timezone.localize(getDateTimeFromISO8601String(time["date"]))
+
+
+def _sync_calendar_events(
+    id: str, start_time: str, end_time: str, cache: SyncCache
+) -> List[CalendarEvent]:
+    """Update the cached events of a calendar and return the ones in the time window.
+
+    The first sync of a window lists all its events. Later ones send the stored
+    sync token and only receive the events that changed since then.
+    """
+    sync = cache.get_calendar_sync(id)
+    items = None
+    full_sync = False
+
+    if (
+        sync is not None
+        and sync["sync_token"]
+        and (sync["window_start"], sync["window_end"]) == (start_time, end_time)
+    ):
+        try:
+            items, sync_token = _list_all_events(id, syncToken=sync["sync_token"])
+        except HttpError as e:
+            # 410 Gone means the sync token expired, a full sync is needed
+            if e.resp.status != 410:
+                raise
+
+    if items is None:
+        full_sync = True
+        items, sync_token = _list_all_events(id, timeMin=start_time, timeMax=end_time)
+    metrics.inc(
+        "scheduler_cache_requests_total",
+        cache="calendar_sync",
+        result="miss" if full_sync else "hit",
+    )
+
+    cache.save_calendar_events(
+        id, items, sync_token, start_time, end_time, full_sync=full_sync
+    )
+
+    # Incremental changes are not limited to the window, filter them locally
+    window_start = getDateTimeFromISO8601String(start_time)
+    window_end = getDateTimeFromISO8601String(end_time)
+    cached_events = [
+        event
+        for event in cache.get_calendar_events(id)
+        if _event_time(event["start"]) < window_end
+        and _event_time(event["end"]) > window_start
+    ]
+    cached_events.sort(key=lambda event: _event_time(event["start"]))
+
+    return [_to_calendar_event(event) for event in cached_events]
+
+
+def _iter_pages(list_method: Callable, **kwargs) -> Iterator[Dict[str, Any]]:
+    """Request the pages of a list method one by one, following nextPageToken.
+
+    Args:
+        list_method: List method of a service resource, e.g. service.events().list.
+        **kwargs: Parameters of the request, e.g. maxResults and fields.
+    """
+    page_token = None
+    while True:
+        page = list_method(pageToken=page_token, **kwargs).execute()
+        yield page
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            return
+
+
+def _iter_items(list_method: Callable, **kwargs) -> Iterator[Dict[str, Any]]:
+    """Yield the items of every page of a list method."""
+    for page in _iter_pages(list_method, **kwargs):
+        yield from page.get("items", [])
+
+
+def _list_all_events(id: str, **kwargs) -> tuple[List[Dict[str, Any]], str | None]:
+    """List the events of every page and return them with the next sync token."""
+    items = []
+    for page in _iter_pages(
+        get_calendar_service().events().list,
+        calendarId=id,
+        singleEvents=True,
+        maxResults=MAX_EVENTS_PAGE_SIZE,
+        fields=EVENT_FIELDS,
+        **kwargs,
+    ):
+        items.extend(page.get("items", []))
+    # Only the last page has the sync token
+    return items, page.get("nextSyncToken")
+
+
 def list_tasks() -> List[Dict[str, Any]]:
     """List all task lists."""
-    tasklists_result = tasks_service.tasklists().list().execute()
     tasklists = [
         TaskListModel(title=task_list["title"], id=task_list["id"])
-        for task_list in tasklists_result.get("items", [])
+        for task_list in _iter_items(
+            get_tasks_service().tasklists().list,
+            maxResults=MAX_TASK_LISTS_PAGE_SIZE,
+            fields=TASK_LIST_FIELDS,
+        )
     ]
     return tasklists
 
 
-def get_tasks(task_list_id: str = "@default") -> List[Dict[str, Any]]:
+def get_tasks(
+    task_list_id: str = "@default", cache: SyncCache = None
+) -> List[Dict[str, Any]]:
     """Fetch tasks from a specific task list.
 
     Args:
         task_list_id (str): The id of the task list to get the tasks from.
+        cache (SyncCache): Local cache, when given only the tasks updated since the
+            last sync are requested.
     """
+    if cache is not None:
+        return _sync_tasks(task_list_id, cache)
 
     # Get incomplete tasks
-    tasks_result = (
-        tasks_service.tasks()
-        .list(
-            tasklist=task_list_id,
-            showCompleted=False,
-            showHidden=False,
-            showDeleted=False,
-        )
-        .execute()
+    tasks = _list_all_tasks(
+        task_list_id, showCompleted=False, showHidden=False, showDeleted=False
+    )
+
+    tasks = [_to_task(task) for task in tasks]
+
+    return tasks
+
+
+def _to_task(task: Dict[str, Any]) -> TaskModel:
+    return TaskModel(
+        id=task["id"],
+        title=task["title"],
+        notes=task.get("notes", ""),
+        due_date=task.get("due", "No due date"),
     )
 
-    tasks = tasks_result.get("items", [])
 
-    tasks = [
-        TaskModel(
-            id=task["id"],
-            title=task["title"],
-            notes=task.get("notes", ""),
-            due_date=task.get("due", "No due date"),
+def _sync_tasks(task_list_id: str, cache: SyncCache) -> List[TaskModel]:
+    """Update the cached tasks of a task list and return its open tasks.
+
+    The first sync lists the open tasks. Later ones request the tasks updated
+    since the previous sync, including completed and deleted ones so they are
+    removed from the cache.
+    """
+    updated_min = cache.get_task_sync(task_list_id)
+    # Taken before the request so changes made while listing are not missed
+    sync_time = datetime.now(dt_timezone.utc).isoformat(timespec="milliseconds")
+
+    if updated_min is None:
+        items = _list_all_tasks(
+            task_list_id, showCompleted=False, showHidden=False, showDeleted=False
+        )
+    else:
+        items = _list_all_tasks(
+            task_list_id,
+            updatedMin=updated_min,
+            showCompleted=True,
+            showHidden=True,
+            showDeleted=True,
         )
-        for task in tasks
-    ]
 
-    return tasks
+    cache.save_tasks(
+        task_list_id, items, sync_time, full_sync=updated_min is None
+    )
+    metrics.inc(
+        "scheduler_cache_requests_total",
+        cache="task_sync",
+        result="miss" if updated_min is None else "hit",
+    )
+
+    return [_to_task(task) for task in cache.get_tasks(task_list_id)]
+
+
+def _list_all_tasks(task_list_id: str, **kwargs) -> List[Dict[str, Any]]:
+    """List the tasks of every page."""
+    return list(
+        _iter_items(
+            get_tasks_service().tasks().list,
+            tasklist=task_list_id,
+            maxResults=MAX_TASKS_PAGE_SIZE,
+            fields=TASK_FIELDS,
+            **kwargs,
+        )
+    )
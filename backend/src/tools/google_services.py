@@ -0,0 +1,291 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Iterator
+import threading
+import json
+import os
+import re
+
+# Google API client libraries
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from google.auth.transport.requests import Request
+from google.auth.exceptions import RefreshError
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
+
+from src import metrics
+
+# Scopes for API access
+SCOPES = [
+    "https://www.googleapis.com/auth/calendar",
+    "https://www.googleapis.com/auth/tasks",
+]
+TOKEN_FILE = "token.json"
+CREDENTIALS_FILE = "credentials.json"
+# Seconds before the expiry of the token when it is refreshed in the background
+REFRESH_MARGIN = 300
+# Id of the main calendar of the authenticated user
+PRIMARY_CALENDAR = "primary"
+# User ids are used as file names
+USER_ID_REGEX = re.compile(r"[A-Za-z0-9_@-][A-Za-z0-9_.@-]*")
+
+
+class InstrumentedHttpRequest(HttpRequest):
+    """Request of the Google API client that records its duration and errors."""
+
+    def execute(self, http=None, num_retries=0):
+        with metrics.timer(
+            "scheduler_google_request_duration_seconds", method=self.methodId
+        ):
+            try:
+                return super().execute(http=http, num_retries=num_retries)
+            except Exception:
+                metrics.inc(
+                    "scheduler_google_request_errors_total", method=self.methodId
+                )
+                raise
+
+
+class GoogleServices:
+    """Lazily authenticated Google Calendar and Tasks service clients.
+
+    Nothing is read from disk or the network until a service is first used.
+    The credentials are cached and refreshed in a background thread shortly
+    before they expire, so requests do not wait for the token refresh.
+    """
+
+    def __init__(
+        self,
+        token_file: str = TOKEN_FILE,
+        credentials_file: str = CREDENTIALS_FILE,
+        refresh_margin: int = REFRESH_MARGIN,
+        calendar_id: str | None = None,
+        interactive: bool = True,
+    ) -> None:
+        """
+        Args:
+            token_file (str): File where the user token is stored.
+            credentials_file (str): OAuth client secrets of the application.
+            refresh_margin (int): Seconds before expiry when the token is refreshed.
+            calendar_id (str): Calendar where the events are created. Defaults to
+                'CALENDAR_ID' found in the environment variables.
+            interactive (bool): Whether the browser authorization flow can be run
+                when there is no valid token. Servers should not run it.
+        """
+        self.token_file = token_file
+        self.credentials_file = credentials_file
+        self.refresh_margin = refresh_margin
+        self.calendar_id = calendar_id or os.getenv("CALENDAR_ID")
+        self.interactive = interactive
+
+        self._lock = threading.RLock()
+        self._creds = None
+        self._refresh_timer = None
+        # Service clients are not thread safe, each thread builds its own ones
+        self._local = threading.local()
+
+    @property
+    def credentials(self) -> Credentials:
+        with self._lock:
+            if self._creds is None or not self._creds.valid:
+                self._creds = self._authenticate(self._creds)
+                self._schedule_refresh()
+            return self._creds
+
+    @property
+    def calendar(self):
+        """Google Calendar v3 service client."""
+        return self._get_service("calendar", "v3")
+
+    @property
+    def tasks(self):
+        """Google Tasks v1 service client."""
+        return self._get_service("tasks", "v1")
+
+    def _get_service(self, name: str, version: str):
+        creds = self.credentials
+        services = self._local.__dict__.setdefault("services", {})
+        # Rebuild when the credentials object changed (e.g. new authentication)
+        if name not in services or services[name][0] is not creds:
+            service = build(
+                name,
+                version,
+                credentials=creds,
+                requestBuilder=InstrumentedHttpRequest,
+            )
+            services[name] = (creds, service)
+        return services[name][1]
+
+    def _authenticate(self, creds: Credentials | None) -> Credentials:
+        """Load, refresh or create the credentials and save them to the token file."""
+        # Check for existing token
+        if creds is None and os.path.exists(self.token_file):
+            with open(self.token_file) as token:
+                creds = Credentials.from_authorized_user_info(json.load(token), SCOPES)
+
+        if creds and creds.valid:
+            return creds
+
+        # If there are no valid credentials, authenticate
+        try:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                creds = self._run_flow()
+        except RefreshError as e:
+            print(f"An error occurred during authentication: {e}")
+            creds = self._run_flow()
+
+        self._save(creds)
+        print("Authentication successful!")
+        return creds
+
+    def _run_flow(self) -> Credentials:
+        if not self.interactive:
+            raise RuntimeError(
+                f"No valid Google token in '{self.token_file}', the user has to "
+                "authorize the application again"
+            )
+        flow = InstalledAppFlow.from_client_secrets_file(self.credentials_file, SCOPES)
+        return flow.run_local_server(port=0)
+
+    def _save(self, creds: Credentials) -> None:
+        """Save credentials for next run."""
+        with open(self.token_file, "w") as token:
+            token.write(creds.to_json())
+
+    def _schedule_refresh(self) -> None:
+        """Start a timer that refreshes the token before it expires."""
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+            self._refresh_timer = None
+
+        if self._creds is None or not self._creds.expiry or not self._creds.refresh_token:
+            return
+
+        # Credentials.expiry is a naive datetime in UTC
+        expiry = self._creds.expiry.replace(tzinfo=timezone.utc)
+        delay = (expiry - datetime.now(timezone.utc)).total_seconds()
+        delay = max(delay - self.refresh_margin, 0)
+
+        self._refresh_timer = threading.Timer(delay, self._background_refresh)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def close(self) -> None:
+        """Stop refreshing the token in the background."""
+        with self._lock:
+            if self._refresh_timer is not None:
+                self._refresh_timer.cancel()
+                self._refresh_timer = None
+
+    def _background_refresh(self) -> None:
+        with self._lock:
+            try:
+                self._creds.refresh(Request())
+                self._save(self._creds)
+            except Exception as e:
+                # The next request refreshes the token or authenticates again
+                print(f"Could not refresh the Google token in background: {e}")
+                self._refresh_timer = None
+                return
+            self._schedule_refresh()
+
+
+class GoogleServicesCache:
+    """Bounded cache of the Google services of many users, keyed by user id.
+
+    Each user has its own token file in token_dir, and the events are created
+    in the primary calendar of the user by default. The least recently used
+    users are evicted when there are more than max_size.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 128,
+        token_dir: str = "tokens",
+        credentials_file: str = CREDENTIALS_FILE,
+    ) -> None:
+        self.max_size = max_size
+        self.token_dir = token_dir
+        self.credentials_file = credentials_file
+        self._services: OrderedDict[str, GoogleServices] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> GoogleServices:
+        if not USER_ID_REGEX.fullmatch(user_id):
+            raise ValueError(f"Invalid user id '{user_id}'")
+
+        with self._lock:
+            services = self._services.get(user_id)
+            if services is None:
+                services = GoogleServices(
+                    token_file=os.path.join(self.token_dir, f"{user_id}.json"),
+                    credentials_file=self.credentials_file,
+                    # Never the CALENDAR_ID of the environment, the operator's one
+                    calendar_id=PRIMARY_CALENDAR,
+                    interactive=False,
+                )
+                self._services[user_id] = services
+                if len(self._services) > self.max_size:
+                    _, evicted = self._services.popitem(last=False)
+                    evicted.close()
+            else:
+                self._services.move_to_end(user_id)
+            return services
+
+
+default_services = GoogleServices()
+# Services of the user of the current run, the default ones when not set
+_current_services: ContextVar[GoogleServices | None] = ContextVar(
+    "google_services", default=None
+)
+# Calendar of the current run, the one of the services when not set
+_current_calendar_id: ContextVar[str | None] = ContextVar("calendar_id", default=None)
+
+
+@contextmanager
+def use_services(services: GoogleServices) -> Iterator[GoogleServices]:
+    """Use the given services for the Google API calls made inside the block."""
+    token = _current_services.set(services)
+    try:
+        yield services
+    finally:
+        _current_services.reset(token)
+
+
+def get_services() -> GoogleServices:
+    """Get the Google services of the current user."""
+    return _current_services.get() or default_services
+
+
+@contextmanager
+def use_calendar(calendar_id: str | None) -> Iterator[str | None]:
+    """Create the events of the runs inside the block in the given calendar.
+
+    The services are shared by all the runs of a user, so the calendar of a
+    run is kept apart. None keeps the calendar of the services.
+    """
+    token = _current_calendar_id.set(calendar_id)
+    try:
+        yield calendar_id
+    finally:
+        _current_calendar_id.reset(token)
+
+
+def get_calendar_id() -> str | None:
+    """Get the calendar where the events of the current run are created."""
+    return _current_calendar_id.get() or get_services().calendar_id
+
+
+def get_calendar_service():
+    """Get the Google Calendar service client, authenticating on first use."""
+    return get_services().calendar
+
+
+def get_tasks_service():
+    """Get the Google Tasks service client, authenticating on first use."""
+    return get_services().tasks
@@ -1,36 +1,206 @@
+import codecs
 import json
 import requests
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
 from langchain_community.tools import tool
+from src.tools.tool_utils import parallel_safe
 
+from src.cache import ReadingTimeCache
+from src import metrics
+
+# Reading speed in words per minute
+WPM = 200
+# Maximum number of bytes read from a page, the rest of the page is ignored
+MAX_PAGE_BYTES = 2 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+TEXT_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+# Tags whose text is not visible
+SKIPPED_TAGS = {"script", "style", "noscript", "template"}
+# Tags that do not separate the words around them
+INLINE_TAGS = {
+    "a", "abbr", "b", "code", "em", "i", "mark", "small", "span", "strong", "sub", "sup", "u"
+}
+
+
+class _TextExtractor(HTMLParser):
+    """Incremental HTML parser that counts the visible words of a page.
+
+    The page is fed in chunks and no DOM is built, the visible text is only
+    kept when collect_text is True.
+    """
+
+    def __init__(self, collect_text: bool = False) -> None:
+        super().__init__(convert_charrefs=True)
+        self.collect_text = collect_text
+        self.words = 0
+        self._parts = []
+        self._skip_depth = 0
+        self._in_word = False
+
+    def handle_starttag(self, tag, attrs) -> None:
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag not in INLINE_TAGS:
+            self._break()
+
+    def handle_endtag(self, tag) -> None:
+        if tag in SKIPPED_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag not in INLINE_TAGS:
+            self._break()
+
+    def handle_data(self, data) -> None:
+        if self._skip_depth == 0:
+            self.add_text(data)
+
+    def add_text(self, data: str) -> None:
+        for char in data:
+            if char.isspace():
+                self._in_word = False
+            elif not self._in_word:
+                self._in_word = True
+                self.words += 1
+        if self.collect_text:
+            self._parts.append(data)
+
+    def _break(self) -> None:
+        self._in_word = False
+        if self.collect_text:
+            self._parts.append("\n")
+
+    @property
+    def text(self) -> str:
+        text = "".join(self._parts)
+        return '\n'.join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def _read_page(
+    url: str,
+    collect_text: bool = False,
+    max_bytes: int = MAX_PAGE_BYTES,
+    headers: dict = None,
+) -> tuple[requests.Response, _TextExtractor | None]:
+    """Stream a page and extract its text without loading it whole in memory.
+
+    The Content-Type is checked before downloading the body, which is then read
+    in chunks up to max_bytes and parsed incrementally.
+
+    Returns:
+        tuple: The response and the extractor, which is None when the server
+            answered 304 Not Modified.
+    """
+    with (
+        metrics.timer("scheduler_web_fetch_duration_seconds"),
+        requests.get(url, timeout=10, headers=headers, stream=True) as response,
+    ):
+        if response.status_code == 304:
+            return response, None
+        response.raise_for_status()
+
+        content_type = response.headers.get("Content-Type", "text/html")
+        media_type = content_type.split(";")[0].strip().lower()
+        if media_type not in TEXT_CONTENT_TYPES:
+            raise ValueError(f"Unsupported content type '{media_type}'")
+
+        content_length = int(response.headers.get("Content-Length") or 0)
+        if content_length > max_bytes:
+            print(f"'{url}' has {content_length} bytes, only reading {max_bytes}")
+
+        extractor = _TextExtractor(collect_text=collect_text)
+        feed = extractor.add_text if media_type == "text/plain" else extractor.feed
+        decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(
+            errors="replace"
+        )
+
+        read_bytes = 0
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            chunk = chunk[: max_bytes - read_bytes]
+            read_bytes += len(chunk)
+            feed(decoder.decode(chunk))
+            if read_bytes >= max_bytes:
+                break
+        feed(decoder.decode(b"", final=True))
+        if media_type != "text/plain":
+            extractor.close()
+
+    return response, extractor
+
+
+@parallel_safe
 @tool
 def get_webpage_text(url: str) -> str:
     """Fetches and returns the text content of a web page given its URL."""
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Remove scripts and style tags
-        for script in soup(["script", "style"]):
-            script.decompose()
-
-        text = soup.get_text()
-        return '\n'.join(line.strip() for line in text.splitlines() if line.strip())
+        _, extractor = _read_page(url, collect_text=True)
+        return extractor.text
     except Exception as e:
         return f"Failed to fetch the URL content: {str(e)}"
-    
-@tool 
-def get_time_read(url: str):
-    """Estimates the time it would take to read the web page given its URL
-    
+
+
+def estimate_reading_time(url: str, cache: ReadingTimeCache = None) -> str:
+    """Estimate the time it would take to read a web page from its number of words.
+
+    With a cache, fresh entries are returned without any request and stale ones
+    are revalidated with If-None-Match/If-Modified-Since, so the page is only
+    downloaded again when it changed.
+
     Args:
         url (str): URL of the site/blog/article
+        cache (ReadingTimeCache): Cache of the reading times.
+
+    Returns:
+        str: Reading time, e.g. "12.5 minutes".
     """
+    entry = cache.get(url) if cache is not None else None
+    if entry is not None and cache.is_fresh(entry):
+        metrics.inc(
+            "scheduler_cache_requests_total", cache="reading_time", result="hit"
+        )
+        return entry["time"]
+
+    headers = {}
+    if entry is not None:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
 
-    wpm = 200
-    text = get_webpage_text.invoke(url)
+    response, extractor = _read_page(url, headers=headers)
+    if extractor is None:
+        if entry is None:
+            raise ValueError(f"Unexpected 304 Not Modified response from '{url}'")
+        cache.touch(url)
+        metrics.inc(
+            "scheduler_cache_requests_total", cache="reading_time", result="revalidated"
+        )
+        return entry["time"]
 
-    time = len(text) / wpm
+    time = f"{round(extractor.words / WPM, 1)} minutes"
+
+    if cache is not None:
+        metrics.inc(
+            "scheduler_cache_requests_total", cache="reading_time", result="miss"
+        )
+        cache.save(
+            url,
+            time,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+    return time
+
+
+@parallel_safe
+@tool
+def get_time_read(url: str):
+    """Estimates the time it would take to read the web page given its URL
+
+    Args:
+        url (str): URL of the site/blog/article
+    """
+    try:
+        time = estimate_reading_time(url)
+    except Exception as e:
+        return json.dumps({"url": url, "error": f"Failed to fetch the URL content: {e}"})
 
-    return json.dumps({"url": url, "time": f"{time} minutes"})
\ No newline at end of file
+    return json.dumps({"url": url, "time": time})
@@ -1,23 +1,31 @@
 # Agents and tools
 from langchain.tools import BaseTool, StructuredTool, tool
+from src.tools.tool_utils import parallel_safe
 from datetime import datetime, timedelta
 import pytz
 
+from src.utils import getDateTimeFromISO8601String
 
+timezone = pytz.timezone("Europe/Madrid")
+
+
+@parallel_safe
 @tool
 def get_current_time() -> str:
     """Get the current time in ISO format."""
 
     # Get the current time in local timezone
-    local_now = datetime.now(pytz.timezone("Europe/Madrid"))
+    local_now = datetime.now(timezone)
 
     return local_now.isoformat()
 
 
+@parallel_safe
 @tool
 def get_date_in_iso_format(date_str: str) -> str:
     """Get the time from a date string in ISO format
     From (YYYY-MM-DD HH:MM) to (YYYY-MM-DDTHH:MM:SS).
+    Dates with a UTC offset (YYYY-MM-DD HH:MM+HH:MM) keep it.
 
     Args:
         date_str (str): The date in the format YYYY-MM-DD HH:MM to convert into ISO format.
@@ -27,7 +35,7 @@ def get_date_in_iso_format(date_str: str) -> str:
         Output: "2023-10-01T12:30:00"
     """
     # Parse the date string
-    date_obj = datetime.strptime(date_str, "%Y-%m-%d %H:%M")
+    date_obj = getDateTimeFromISO8601String(date_str)
 
     # Convert to ISO format
     iso_time = date_obj.isoformat()
@@ -48,12 +56,13 @@ class SumToDateInput(BaseModel):
     minutes: int = Field(description="Number of minutes to add")
 
 
+@parallel_safe
 @tool(args_schema=SumToDateInput)
 def sum_to_date(date_str: str, weeks: int, days: int, hours: int, minutes: int) -> str:
     """Add weeks, days, hours, and minutes to a date string in ISO format.
 
     Args:
-        date_str: The date string in ISO format
+        date_str: The date string in ISO format, with or without UTC offset
         weeks (int): the number of weeks to sum
         days (int): the number of days to sum
         hours (int): the number of hours to sum
@@ -62,7 +71,11 @@ def sum_to_date(date_str: str, weeks: int, days: int, hours: int, minutes: int)
 
     Returns: The resulting date in ISO format.
     """
-    date_obj = datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S")
-    return (
-        date_obj + timedelta(weeks=weeks, days=days, hours=hours, minutes=minutes)
-    ).isoformat()
+    date_obj = getDateTimeFromISO8601String(date_str)
+    delta = timedelta(weeks=weeks, days=days, hours=hours, minutes=minutes)
+    if date_obj.tzinfo is None:
+        return (date_obj + delta).isoformat()
+
+    # Add to the local time, so the offset changes with daylight saving time
+    local = date_obj.astimezone(timezone).replace(tzinfo=None)
+    return timezone.localize(local + delta).isoformat()
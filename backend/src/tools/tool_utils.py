@@ -0,0 +1,13 @@
+from langchain_core.tools import BaseTool
+
+PARALLEL_SAFE = "parallel_safe"
+
+
+def parallel_safe(tool: BaseTool) -> BaseTool:
+    """Mark a tool as safe to run at the same time as other tool calls of the same turn."""
+    tool.metadata = {**(tool.metadata or {}), PARALLEL_SAFE: True}
+    return tool
+
+
+def is_parallel_safe(tool: BaseTool) -> bool:
+    return bool((tool.metadata or {}).get(PARALLEL_SAFE))
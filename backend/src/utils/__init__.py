@@ -1 +1,2 @@
-from .time_utils import parse_iso_date
+from .time_utils import parse_iso_date, getDateTimeFromISO8601String, local_datetime
+from .concurrency import run_concurrently
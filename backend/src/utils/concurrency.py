@@ -0,0 +1,98 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextvars import copy_context
+from typing import Callable, Iterable, TypeVar
+import time
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def run_concurrently(
+    func: Callable[[T], R],
+    items: Iterable[T],
+    max_workers: int = 8,
+    timeout: float | None = None,
+) -> list[tuple[R | None, Exception | None]]:
+    """Run func over every item in a bounded thread pool.
+
+    The results keep the order of the input items. A failing item does not stop
+    the others, its exception is returned next to it instead.
+
+    Args:
+        func (Callable): Function called once per item.
+        items (Iterable): Items to process.
+        max_workers (int): Maximum number of threads running at the same time.
+        timeout (float): Seconds each item may run, counted from when it starts.
+            Items that take longer get a TimeoutError, although their thread
+            cannot be stopped and keeps running in the background.
+
+    Returns:
+        list[tuple]: One (result, error) pair per item, error is None on success.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    def safe_call(item: T) -> tuple[R | None, Exception | None]:
+        try:
+            return func(item), None
+        except Exception as e:
+            return None, e
+
+    if max_workers <= 1:
+        if timeout is None:
+            return [safe_call(item) for item in items]
+        # One at a time, in a thread of its own so the next item does not wait
+        # for one that timed out
+        return [_call_with_timeout(safe_call, item, timeout) for item in items]
+
+    started = {}
+
+    def timed_call(index: int, item: T) -> tuple[R | None, Exception | None]:
+        started[index] = time.monotonic()
+        return safe_call(item)
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(items)))
+    try:
+        # Each task runs in a copy of the caller's context so context variables
+        # (callbacks, selected user...) are visible inside the worker threads
+        futures = [
+            executor.submit(copy_context().run, timed_call, index, item)
+            for index, item in enumerate(items)
+        ]
+
+        results = []
+        for index, future in enumerate(futures):
+            while True:
+                if timeout is None:
+                    results.append(future.result())
+                    break
+                # Items waiting for a free worker have not used their time yet
+                start = started.get(index, time.monotonic())
+                remaining = max(start + timeout - time.monotonic(), 0)
+                try:
+                    results.append(future.result(timeout=remaining))
+                    break
+                except FutureTimeoutError:
+                    if index in started:
+                        error = TimeoutError(f"Timed out after {timeout} seconds")
+                        results.append((None, error))
+                        break
+        return results
+    finally:
+        # Do not wait for the threads of the items that timed out
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _call_with_timeout(
+    func: Callable[[T], tuple[R | None, Exception | None]], item: T, timeout: float
+) -> tuple[R | None, Exception | None]:
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        future = executor.submit(copy_context().run, func, item)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            return None, TimeoutError(f"Timed out after {timeout} seconds")
+    finally:
+        executor.shutdown(wait=False)
@@ -1,11 +1,34 @@
-from datetime import datetime
-import dateutil
+from datetime import date, datetime, time
+from functools import lru_cache
+import dateutil.parser
+import pytz
+
+# Number of parsed strings kept in memory
+ISO_CACHE_SIZE = 4096
+timezone = pytz.timezone("Europe/Madrid")
+
+
+def local_datetime(day: date, at: time) -> datetime:
+    """Get the local time of a day, with the UTC offset of that day (DST changes)."""
+    return timezone.localize(datetime.combine(day, at))
+
+
+# Only the results of fromisoformat are memoized. dateutil fills the missing
+# fields with the current date, so its results can change from one day to the next
+_from_iso_format = lru_cache(maxsize=ISO_CACHE_SIZE)(datetime.fromisoformat)
 
 
 def getDateTimeFromISO8601String(s) -> datetime:
-    """Convert an ISO 8601 string to a datetime object."""
-    d = dateutil.parser.parse(s)
-    return d
+    """Convert an ISO 8601 string to a datetime object.
+
+    The standard formats are parsed with datetime.fromisoformat, dateutil is
+    only used for the ones it rejects. The results of fromisoformat are
+    memoized, datetimes are immutable so every caller can share them.
+    """
+    try:
+        return _from_iso_format(s)
+    except ValueError:
+        return dateutil.parser.parse(s)
 
 
 def parse_iso_date(s) -> str: